@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark of Band.clean on synthetic binary images with increasing number of
+blobs, against the previous per-label loop implementation.
+
+usage: python bench_clean.py [size]
+'''
+
+import sys
+import time
+import numpy as np
+from scipy import ndimage
+
+from pyintdem.core import Band
+
+def blobs(size, nblob, seed=42):
+    # binary image with nblob random square blobs on a regular grid, so that
+    # the blobs do not merge
+    rng = np.random.default_rng(seed)
+    data = np.zeros((size, size))
+    step = max(int(size/np.sqrt(nblob)), 2)
+    for row in range(0, size-1, step):
+        for col in range(0, size-1, step):
+            width = rng.integers(1, step)
+            data[row:row+width, col:col+width] = 1
+    return data
+
+def clean_loop(data, npixel, fillvalue):
+    # previous implementation of Band.clean (background=False)
+    inan = np.isnan(data)
+    out = np.ones(shape=data.shape)
+    labels, _ = ndimage.label(np.nanmax(data)-data)
+    _, count = np.unique(labels, return_counts=True)
+    retained_labels = np.argwhere(count>=npixel).ravel()
+    retained_labels = retained_labels[retained_labels>0]
+    for label in retained_labels:
+        out[labels==label] = fillvalue
+    out[inan] = np.nan
+    return out
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    npixel = 2
+
+    print(f'Image {size}x{size}, npixel={npixel}')
+    print('{:>8s} {:>10s} {:>12s} {:>12s} {:>8s}'.format('nblob', 'nlabel', 'loop (s)', 'vector (s)', 'equal'))
+    for nblob in [100, 1000, 4000, 16000]:
+        data = 1 - blobs(size, nblob)
+        nlabel = ndimage.label(1-data)[1]
+
+        start = time.perf_counter()
+        expected = clean_loop(data, npixel=npixel, fillvalue=0)
+        tloop = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = Band(data=data).clean(npixel=npixel, fillvalue=0, background=False)
+        tvector = time.perf_counter() - start
+
+        equal = np.array_equal(expected, result.data, equal_nan=True)
+        print('{:>8d} {:>10d} {:>12.3f} {:>12.3f} {:>8s}'.format(nblob, nlabel, tloop, tvector, str(equal)))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark of the working dtype on a full Sentinel-2 10m tile (10980x10980).
+
+A synthetic int16 reflectance tile with -10000 as missing value is processed
+with the first steps of step_3_analysis (read, missing value, scaling,
+normalization, threshold) using float64, float32 and raw int16 reading. Each
+run is done in a separate process to measure its peak memory (RSS).
+
+usage: python bench_dtype.py [size]
+'''
+
+import os
+import sys
+import time
+import resource
+import tempfile
+import multiprocessing as mp
+import numpy as np
+from osgeo import gdal
+
+from pyintdem.core import Band, set_dtype
+
+def create_tile(fname, size):
+    rng = np.random.default_rng(42)
+    data = rng.integers(0, 4096, size=(size, size), dtype=np.int16)
+    data[:, :size//10] = -10000
+    driver = gdal.GetDriverByName('GTiff')
+    gtiff = driver.Create(fname, size, size, 1, gdal.GDT_Int16)
+    gtiff.SetGeoTransform((600000.0, 10.0, 0.0, 2500020.0, 0.0, -10.0))
+    gtiff.GetRasterBand(1).WriteArray(data)
+    gtiff.FlushCache()
+    gtiff = None
+
+def run(fname, dtype, queue):
+    if dtype == 'raw':
+        set_dtype(np.float32)
+        read_dtype = 'raw'
+    else:
+        set_dtype(dtype)
+        read_dtype = None
+
+    start = time.perf_counter()
+    band = Band()
+    band.read(fname, band=1, dtype=read_dtype)
+    band.set_missing(value=-10000, to=np.nan)
+    band = band/10000
+    band.normalize(method='minmax')
+    band = band < 0.5
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+    queue.put((elapsed, rss, str(band.dtype)))
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10980
+    nbytes = size*size*8/1024**2
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'tile.tif')
+        create_tile(fname, size)
+
+        print(f'Tile {size}x{size}, {nbytes:.0f} MB as float64')
+        print('{:<10s} {:>10s} {:>12s} {:>12s} {:>10s}'.format('dtype', 'time (s)', 'Mpix/s', 'peak RSS MB', 'result'))
+        ctx = mp.get_context('spawn')
+        for dtype in ['float64', 'float32', 'raw']:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run, args=(fname, dtype, queue))
+            proc.start()
+            elapsed, rss, result = queue.get()
+            proc.join()
+            print('{:<10s} {:>10.2f} {:>12.1f} {:>12.0f} {:>10s}'.format(
+                dtype, elapsed, size*size/elapsed/1e6, rss, result))
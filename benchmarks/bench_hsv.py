@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark of the RGB to HSV conversion: the vectorized rgb_to_hsv (all
+channels, hue and value only, multithreaded) against matplotlib and the
+previous per-pixel np.apply_along_axis implementation. The per-pixel method
+is timed on a small crop and extrapolated.
+
+usage: python bench_hsv.py [size] [nthreads]
+'''
+
+import sys
+import time
+import numpy as np
+import matplotlib.colors as mcl
+
+from pyintdem.core import RGB, rgb_to_hsv
+
+def timeit(func, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def matplotlib_hsv(red, green, blue):
+    # previous RGB.to_hsv(method='matplotlib'), with the rgb cube
+    rgb = np.dstack([red, green, blue])
+    inan = np.isnan(rgb[:, :, 0])
+    hsv = mcl.rgb_to_hsv(rgb)
+    hsv[inan] = np.nan
+    return hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
+
+def apply_hsv(red, green, blue):
+    # previous RGB.to_hsv(method='local')
+    rgb = np.dstack([red, green, blue])
+    f = lambda x: RGB.rgb2hsv(r=x[0], g=x[1], b=x[2])
+    hsv = np.apply_along_axis(func1d=f, axis=2, arr=rgb)
+    return hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    nthreads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    rng = np.random.default_rng(42)
+    red, green, blue = [rng.random((size, size)) for _ in range(3)]
+    red[rng.random((size, size)) < 0.05] = np.nan
+
+    tref, expected = timeit(lambda: matplotlib_hsv(red, green, blue))
+
+    crop = min(size, 256)
+    tcrop, _ = timeit(lambda: apply_hsv(red[:crop, :crop], green[:crop, :crop], blue[:crop, :crop]), repeat=1)
+    tapply = tcrop*(size/crop)**2
+
+    print(f'Image {size}x{size}')
+    print('{:<36s} {:>10s} {:>8s}'.format('method', 'time (s)', 'equal'))
+    print('{:<36s} {:>10.3f} {:>8s}'.format('apply_along_axis (extrapolated)', tapply, '-'))
+    print('{:<36s} {:>10.3f} {:>8s}'.format('matplotlib', tref, 'ref'))
+
+    cases = [
+        ('rgb_to_hsv', 'hsv', 1),
+        ('rgb_to_hsv hue, value', 'hv', 1),
+        (f'rgb_to_hsv {nthreads} threads', 'hsv', nthreads),
+        (f'rgb_to_hsv hue, value {nthreads} threads', 'hv', nthreads),
+    ]
+    for name, channels, nt in cases:
+        t, result = timeit(lambda: rgb_to_hsv(red, green, blue, channels=channels, nthreads=nt))
+        equal = all(
+            np.allclose(data, expected['hsv'.index(channel)], equal_nan=True)
+            for channel, data in zip(channels, result)
+        )
+        print('{:<36s} {:>10.3f} {:>8s}'.format(name, t, str(equal)))
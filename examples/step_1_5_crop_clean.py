@@ -3,6 +3,11 @@
 Created on Wed Dec  4 16:31:47 2024
 
 @author: LoesLGLG
+
+The files are cropped and rewritten on disk. The same area can also be read
+directly from the archives, without rewriting the files, with the area of
+interest of pyintdem.data.Database / DataFile, e.g.,
+Database(fdir, aoi=polygon_coords_wgs84).
 """
 
 #%% IMPORTS
@@ -10,7 +10,13 @@ out_dir='/run/media/khan/Backup KE Maxelev/Data'
 if not os.path.exists(out_dir):
     os.mkdir(out_dir)
 
-extractor = Extractor(input_dir=data_dir, output_dir=out_dir)
-extractor.list_zones(debug=True)
-for zone in extractor.zones:
-    extractor.extract(zone=zone)
\ No newline at end of file
+# Only the bands used in the analysis and the quicklook are extracted. The
+# extraction can also be skipped, the zip files are read in place by Sentinel2
+# and Extractor.mount
+patterns = ['*FRE_B2.tif', '*FRE_B4.tif', '*FRE_B8.tif', '*FRE_B11.tif', '*.jpg']
+
+if __name__=='__main__':
+    extractor = Extractor(input_dir=data_dir, output_dir=out_dir)
+    extractor.list_zones(debug=True)
+    for zone in extractor.zones:
+        extractor.extract(zone=zone, patterns=patterns, nworkers=4)
\ No newline at end of file
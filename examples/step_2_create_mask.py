@@ -5,13 +5,17 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 from pyintdem.core import Band, RGB
-from pyintdem.data import Sentinel2
+from pyintdem.data import Sentinel2, configure_vsi_cache
 from tqdm import tqdm
 
 # Input setting
 input_dir='/run/media/khan/Backup KE Maxelev'
 data_dir = os.path.join(input_dir, 'Data')
 
+# The zones of data_dir can hold the extracted tiles (step_1_extract.py) or
+# the zip files, which are read in place without extraction
+configure_vsi_cache(size=256)
+
 # Directory of saving unzipped data
 output_dir = '/run/media/khan/Backup KE Maxelev/Analysis_v3' # Output
 save_dir = os.path.join(output_dir, 'Masks') 
@@ -4,8 +4,8 @@
 import os
 import gc
 import numpy as np
-from pyintdem.core import Band, RGB
-from pyintdem.data import Sentinel2
+from pyintdem.core import Band, RGB, hsv_bands
+from pyintdem.data import Sentinel2, configure_vsi_cache
 
 # Directory Settings
 input_dir='/run/media/khan/Backup KE Maxelev'
@@ -14,6 +14,11 @@ input_dir='/run/media/khan/Backup KE Maxelev'
 output_dir = '/run/media/khan/Backup KE Maxelev/Analysis_v3' # Output
 
 data_dir = os.path.join(input_dir, 'Data')
+
+# The zones of data_dir can hold the extracted tiles (step_1_extract.py) or
+# the zip files, which are read in place without extraction
+configure_vsi_cache(size=256)
+
 mask_dir = os.path.join(output_dir, 'Masks') 
 improc_dir = os.path.join(output_dir, 'Shorelines') 
 vertref_dir = os.path.join(output_dir, 'Referencing') 
@@ -46,10 +51,9 @@ if __name__=='__main__':
 
             # Alpha band
             alpha = Band()
-            alpha.read(fname=snap_file.files['FRE_B11'], band=1)
+            alpha.read(fname=snap_file.files['FRE_B11'], band=1, factor=2) # upscaled to 10m while reading
             alpha.set_missing(value=-10000, to=np.nan)
             alpha = alpha/10000
-            alpha.upscale(factor=2, method='nearest')
             print('Max = {:.2f}, Std = {:.2f}, Mean = {:.2f}, Cut = {:.2f}'.format(alpha.max, alpha.std, alpha.mean, alpha.mean+alpha.std))
             alpha.normalize(method='std', std_factor=1, std_correction='high')
             alpha.plot('Upscaled Normalized Alpha', cmap='binary_r', saveto=os.path.join(snap_save, 'alpha.png'))
@@ -62,7 +66,7 @@ if __name__=='__main__':
             red = red/10000
             red.normalize(method='minmax')
             red.plot('Normalized Red', cmap='binary_r', saveto=os.path.join(snap_save, 'red_norm.png'))
-            red = (red*alpha) + (alpha*-1+1)
+            red = ((red.lazy()*alpha) + (1-alpha.lazy())).compute()
             red.plot('Synthetic Red', cmap='binary_r', saveto=os.path.join(snap_save, 'red_synthetic.png'))
             red.to_geotiff(fname=os.path.join(snap_save, 'red_synthetic.tif'))
 
@@ -73,7 +77,7 @@ if __name__=='__main__':
             green = green/10000
             green.normalize(method='minmax')
             green.plot('Normalized Green', cmap='binary_r', saveto=os.path.join(snap_save, 'green_norm.png'))
-            green = (alpha*-1+1) + (green*alpha)
+            green = ((1-alpha.lazy()) + (green.lazy()*alpha)).compute()
             green.plot('Synthetic Green', cmap='binary_r', saveto=os.path.join(snap_save, 'green_synthetic.png'))
             green.to_geotiff(fname=os.path.join(snap_save, 'green_synthetic.tif'))
 
@@ -84,7 +88,7 @@ if __name__=='__main__':
             blue = blue/10000
             blue.normalize(method='minmax')
             blue.plot('Normalized Blue', cmap='binary_r', saveto=os.path.join(snap_save, 'blue_norm.png'))
-            blue = (alpha*-1+1) + (blue*alpha)
+            blue = ((1-alpha.lazy()) + (blue.lazy()*alpha)).compute()
             blue.plot('Synthetic Blue', 'binary_r', saveto=os.path.join(snap_save, 'blue_synthetic.png'))
             blue.to_geotiff(fname=os.path.join(snap_save, 'green_synthetic.tif'))
 
@@ -92,7 +96,7 @@ if __name__=='__main__':
             rgb = RGB(red=red, green=green, blue=blue)
             del red, green, blue, alpha
             rgb.plot(title='RGB', saveto=os.path.join(snap_save, 'rgb.png'))
-            hue, _, value = rgb.to_hsv(method='matplotlib')
+            hue, value = hsv_bands(rgb.red, rgb.green, rgb.blue, channels='hv')
             del rgb
             hue.plot('Hue', cmap='binary_r', saveto=os.path.join(snap_save, 'hue.png'))
             value.plot('Value', cmap='binary_r', saveto=os.path.join(snap_save, 'value.png'))
@@ -103,7 +107,8 @@ if __name__=='__main__':
             watermask = Band()
             watermask.read(
                 fname=snap_file.watermask(loc=mask_dir, fmt='tif'),
-                band=1
+                band=1,
+                mask_nodata=True # no data of the compact mask as np.nan
                 )
             watermask.plot('Water Mask', cmap='binary_r', saveto=os.path.join(snap_save, 'watermask.png'))
 
@@ -128,17 +133,17 @@ if __name__=='__main__':
             for nhue, nvalue in zip(nhues.flatten(), nvalues.flatten()):
                 # nhue = 1.0
                 hue_bw = (
-                    (hue<(hue_median+nhue*hue_std)).logical_and(
-                        hue>(hue_median-nhue*hue_std)
+                    (hue.lazy()<(hue_median+nhue*hue_std)).logical_and(
+                        hue.lazy()>(hue_median-nhue*hue_std)
                     )
-                ).logical_not()
+                ).logical_not().compute()
                 hue_bw.plot('Hue BW', saveto=os.path.join(snap_save, 'hue_bw_{:.1f}.png'.format(nhue)))
                 hue_bw.to_geotiff(fname=os.path.join(snap_save, 'hue_bw_{:.1f}.tif'.format(nhue)))
                 
                 # nvalue = 1.5
-                value_bw = (value<(value_median+nvalue*value_std)).logical_and(
-                    value>(value_median-nvalue*value_std)
-                )
+                value_bw = (value.lazy()<(value_median+nvalue*value_std)).logical_and(
+                    value.lazy()>(value_median-nvalue*value_std)
+                ).compute()
                 value_bw.plot('Value BW', saveto=os.path.join(snap_save, 'value_bw_{:.1f}.png'.format(nvalue)))
                 value_bw.to_geotiff(fname=os.path.join(snap_save, 'value_bw_{:.1f}.tif'.format(nvalue)))
 
@@ -154,18 +159,10 @@ if __name__=='__main__':
                 bw.to_geotiff(fname=os.path.join(snap_save, 'bw_clean_{:.1f}_{:.1f}.tif'.format(nhue, nvalue)))
 
                 # Shoreline mapping
-                shoreline = bw.convolute(
-                    kernel=[[0, -1, 0], [-1, 4, -1], [0, -1, 0]],
-                    replacenan=False, 
-                    replacevalue=4, 
-                    fillvalue=4, 
-                    nanmask=True,
-                    cleanedge=True
-                )
-                shoreline.position(
-                    xyloc=np.where(shoreline.data==1),
+                bw.shoreline_pixels(
+                    connectivity=1,
+                    fillvalue=4,
                     epsg=4326,
-                    center=True,
                     saveto=os.path.join(snap_save, 'shoreline_{:.1f}_{:.1f}.csv'.format(nhue, nvalue))
                 )
 
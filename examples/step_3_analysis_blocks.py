@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Block streaming version of step_3_analysis.py. The per-pixel steps (missing
+value, scaling, normalization, synthetic bands, hsv and thresholding) are done
+block by block on file backed bands, and written incrementally to the output
+GeoTiff files. Only the blob cleaning and the shoreline detection, which needs
+the full image, are done in memory on the final binary image.
+'''
+
+import os
+import gc
+import numpy as np
+from pyintdem.core import Band, BandStats, BlockWriter, Window, map_blocks, hsv_bands
+from pyintdem.data import Sentinel2, preprocess_theia, configure_vsi_cache
+
+# Directory Settings
+input_dir='/run/media/khan/Backup KE Maxelev'
+
+# Directory of saving unzipped data
+output_dir = '/run/media/khan/Backup KE Maxelev/Analysis_v3' # Output
+
+data_dir = os.path.join(input_dir, 'Data')
+
+# The zones of data_dir can hold the extracted tiles (step_1_extract.py) or
+# the zip files, which are read in place without extraction
+configure_vsi_cache(size=256)
+
+mask_dir = os.path.join(output_dir, 'Masks')
+improc_dir = os.path.join(output_dir, 'Shorelines')
+
+for idir in [data_dir, mask_dir, improc_dir]:
+    if not os.path.exists(idir):
+        os.mkdir(idir)
+
+# Analysis starts
+zones = ['T45QWE', 'T45QXE', 'T45QYE', 'T46QBK', 'T46QCK', 'T46QBL', 'T46QCL']
+
+def lazy_band(fname):
+    band = Band()
+    band.read(fname=fname, band=1, lazy=True)
+    band.preprocess = preprocess_theia
+    return band
+
+def masked_blocks(band, by, inverse=False):
+    # generator of the masked blocks values, for BandStats
+    return lambda: (
+        b.mask(by=m, inverse=inverse).data
+        for (_, b), (_, m) in zip(band.iter_blocks(), by.iter_blocks())
+    )
+
+if __name__=='__main__':
+    for zone in zones:
+        zone_dir = os.path.join(data_dir, zone)
+        snaps = os.listdir(zone_dir)
+        for snap_dir in snaps:
+            print(snap_dir)
+            snap_file = Sentinel2(loc=os.path.join(zone_dir, snap_dir))
+            snap_save = os.path.join(improc_dir, snap_file.info['zone'])
+            if not os.path.exists(snap_save):
+                os.mkdir(snap_save)
+            snap_save = os.path.join(
+                snap_save,
+                snap_file.info['date_time'].strftime('%Y%m%d%H%M%S')
+                )
+            if not os.path.exists(snap_save):
+                os.mkdir(snap_save)
+
+            # Alpha band, normalized with std high correction and upscaled to 10m
+            alpha = lazy_band(snap_file.files['FRE_B11'])
+            amin, amax = alpha.min, alpha.max # one pass, cached in alpha.stats
+            acap = alpha.mean + alpha.std
+            amax = min(amax, acap)
+            red = lazy_band(snap_file.files['FRE_B4'])
+            with BlockWriter(fname=os.path.join(snap_save, 'alpha.tif'), like=red) as writer:
+                for window, block in alpha.iter_blocks():
+                    block.data = (np.fmin(block.data, acap) - amin)/(amax - amin)
+                    block.upscale(factor=2, method='nearest')
+                    window = Window(window.row*2, window.col*2, window.nrows*2, window.ncols*2)
+                    writer.write(window, block.data)
+            alpha = Band()
+            alpha.read(fname=os.path.join(snap_save, 'alpha.tif'), band=1, lazy=True)
+
+            # Synthetic red, green, blue
+            synthetic = {}
+            for color, bname in zip(['red', 'green', 'blue'], ['FRE_B4', 'FRE_B8', 'FRE_B2']):
+                band = lazy_band(snap_file.files[bname])
+                bmin, bmax = band.min, band.max
+                fname = os.path.join(snap_save, f'{color}_synthetic.tif')
+                synthetic[color] = map_blocks(
+                    lambda b, a: ((b - bmin)/(bmax - bmin))*a + (a*-1+1),
+                    [band, alpha],
+                    fname=fname
+                )
+
+            # RGB HSV Conversion
+            rgb_bands = [synthetic['red'], synthetic['green'], synthetic['blue']]
+            hue = map_blocks(
+                lambda r, g, b: hsv_bands(r, g, b, channels='h')[0],
+                rgb_bands,
+                fname=os.path.join(snap_save, 'hue.tif')
+            )
+            value = map_blocks(
+                lambda r, g, b: hsv_bands(r, g, b, channels='v')[0],
+                rgb_bands,
+                fname=os.path.join(snap_save, 'value.tif')
+            )
+
+            # Water masks, thresholds from the masked hue and value
+            # hue and value are in 0-1, the median histogram is computed in the
+            # same pass as the moments with a precision of 1e-4
+            watermask = Band()
+            watermask.read(fname=snap_file.watermask(loc=mask_dir, fmt='tif'), band=1, lazy=True, mask_nodata=True)
+            hue_stats = BandStats(chunks=masked_blocks(hue, watermask, inverse=True), bins=10000, range=(0, 1))
+            value_stats = BandStats(chunks=masked_blocks(value, watermask), bins=10000, range=(0, 1))
+            hue_median, hue_std = hue_stats.median, hue_stats.std
+            value_median, value_std = value_stats.median, value_stats.std
+
+            # Threholding
+            nhue = 0.5
+            nvalue = 3.0
+            bw = map_blocks(
+                lambda h, v: (
+                    (v<(value_median+nvalue*value_std)).logical_and(v>(value_median-nvalue*value_std))
+                ).logical_and(
+                    ((h<(hue_median+nhue*hue_std)).logical_and(h>(hue_median-nhue*hue_std))).logical_not()
+                ),
+                [hue, value],
+                fname=os.path.join(snap_save, 'bw_{:.1f}_{:.1f}.tif'.format(nhue, nvalue))
+            )
+
+            # Cleaning and shoreline mapping on the full binary image
+            bw.read(fname=bw.source[0], band=1)
+            bw = bw.clean(npixel=10000, fillvalue=0, background=False) # Water
+            bw = bw.clean(npixel=10000, fillvalue=1, background=True) # Land
+            bw.to_geotiff(fname=os.path.join(snap_save, 'bw_clean_{:.1f}_{:.1f}.tif'.format(nhue, nvalue)))
+
+            bw.shoreline_pixels(
+                connectivity=1,
+                fillvalue=4,
+                epsg=4326,
+                saveto=os.path.join(snap_save, 'shoreline_{:.1f}_{:.1f}.csv'.format(nhue, nvalue))
+            )
+            bw.shoreline_lines(
+                level=0.5,
+                epsg=4326,
+                saveto=os.path.join(snap_save, 'shoreline_lines_{:.1f}_{:.1f}.csv'.format(nhue, nvalue))
+            )
+
+            del bw
+            gc.collect()
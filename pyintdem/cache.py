@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Persistent on-disk cache of the decoded bands
+
+The decoded (and preprocessed) band data is stored as .npy files, which are
+opened memory-mapped, with a json sidecar holding the georeferencing. The
+least recently used files are removed when the cache grows over its size
+budget.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+
+def source_stat(fname):
+    """Size and modification time of the file holding a band
+
+    For a /vsizip/ path, the zip archive itself is used.
+
+    Args:
+        fname (str): Path of the band, possibly a /vsizip/ path
+
+    Returns:
+        tuple: (path, size, mtime) of the file
+    """
+    fname = str(fname)
+    if fname.startswith('/vsizip/'):
+        fname = fname[len('/vsizip/'):]
+        end = fname.lower().find('.zip')
+        if end >= 0:
+            fname = fname[:end+4]
+
+    stat = os.stat(fname)
+    return (Path(fname).absolute().as_posix(), stat.st_size, stat.st_mtime)
+
+class BandCache(object):
+    def __init__(self, cache_dir, max_size=10*2**30):
+        """On-disk cache of decoded bands with LRU eviction
+
+        Args:
+            cache_dir (str): Directory of the cache, created if needed
+            max_size (int, optional): Size budget of the cache in bytes. Defaults to 10 GiB.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    def key(self, fname, **params):
+        """Key of a band in the cache
+
+        The key changes if the file is modified (size or modification time), or with any of the reading
+        parameters, e.g., band, window, resolution, preprocess and dtype.
+
+        Args:
+            fname (str): Path of the band file
+            **params: Reading parameters, converted to string
+
+        Returns:
+            str: The key
+        """
+        source = source_stat(fname)
+        params = {name: str(value) for name, value in params.items()}
+        text = json.dumps({'source': source, 'params': params}, sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _paths(self, key):
+        return self.cache_dir / f'{key}.npy', self.cache_dir / f'{key}.json'
+
+    def get(self, key):
+        """Cached data of the key
+
+        The data is memory-mapped copy-on-write, i.e., it can be modified in memory without changing the cache.
+
+        Args:
+            key (str): Key, see `key`
+
+        Returns:
+            tuple: (data, metadata), or None if the key is not in the cache
+        """
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r') as fp:
+                meta = json.load(fp)
+            data = np.load(data_path, mmap_mode='c')
+        except (OSError, ValueError):
+            return None
+
+        # the modification time of the data file tracks the last use
+        os.utime(data_path)
+        return data, meta
+
+    def put(self, key, data, meta):
+        """Store data in the cache and evict the least recently used files if needed
+
+        Args:
+            key (str): Key, see `key`
+            data (array like): Data array
+            meta (dict): Metadata, json serializable
+
+        Returns:
+            array like: The stored data, memory-mapped
+        """
+        data_path, meta_path = self._paths(key)
+
+        # written to temporary files first, so that a partial file is never read
+        tmp_data = data_path.with_suffix('.npy.tmp')
+        with open(tmp_data, 'wb') as fp:
+            np.save(fp, np.ascontiguousarray(data))
+        tmp_meta = meta_path.with_suffix('.json.tmp')
+        with open(tmp_meta, 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(tmp_meta, meta_path)
+        os.replace(tmp_data, data_path)
+
+        self.evict()
+        return np.load(data_path, mmap_mode='c') if data_path.exists() else data
+
+    @property
+    def size(self):
+        """Total size of the cached data in bytes"""
+        return sum(path.stat().st_size for path in self.cache_dir.glob('*.npy'))
+
+    def evict(self, max_size=None):
+        """Remove the least recently used files until the cache is within the size budget
+
+        Args:
+            max_size (int, optional): Size budget in bytes. Defaults to None, the cache budget.
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        files = []
+        for path in self.cache_dir.glob('*.npy'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda x: x[0]):
+            if total <= max_size:
+                break
+            for remove in (path, path.with_suffix('.json')):
+                try:
+                    remove.unlink()
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        """Remove all the cached files"""
+        self.evict(max_size=0)
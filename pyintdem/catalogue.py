@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+SQLite catalogue of the datafiles and their bands
+
+The records of pyintdem.data.DataFile (tile, time, mission, product, ...)
+are stored in an indexed table, with the band paths in a second table, so
+that the selection of the datafiles is a database query instead of a loop
+over the nested dictionaries of pyintdem.data.Database.
+'''
+import json
+import sqlite3
+import pandas as pd
+from pathlib import Path
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS datafiles (
+    id INTEGER PRIMARY KEY,
+    fpath TEXT NOT NULL UNIQUE,
+    filetype TEXT,
+    mission TEXT,
+    product TEXT,
+    version TEXT,
+    time TEXT,
+    tile TEXT,
+    size INTEGER,
+    mtime REAL,
+    cloud REAL,
+    valid REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS datafiles_tile_time ON datafiles (tile, time);
+CREATE INDEX IF NOT EXISTS datafiles_time ON datafiles (time);
+CREATE INDEX IF NOT EXISTS datafiles_mission_product ON datafiles (mission, product, time);
+CREATE TABLE IF NOT EXISTS bands (
+    datafile INTEGER NOT NULL REFERENCES datafiles (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (datafile, name)
+);
+'''
+
+# columns of the datafiles table filled from the datafile keys
+COLUMNS = ['fpath', 'filetype', 'mission', 'product', 'version', 'time', 'tile', 'size', 'mtime', 'cloud', 'valid', 'extra']
+
+def format_time(time):
+    return pd.Timestamp(time).strftime(TIME_FORMAT)
+
+def _condition(column, value):
+    # equality, or membership for a list of values
+    if isinstance(value, (list, tuple, set)):
+        value = list(value)
+        return f'{column} IN ({",".join("?"*len(value))})', value
+    else:
+        return f'{column} = ?', [value]
+
+class Catalogue(object):
+    def __init__(self, fname=':memory:'):
+        """SQLite catalogue of the datafiles
+
+        Args:
+            fname (str, optional): Path of the SQLite file, created if needed. Defaults to ':memory:'.
+        """
+        self.fname = str(fname)
+        self.connection = sqlite3.connect(self.fname)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def _record(self, datafile):
+        record = {column: datafile.get(column) for column in COLUMNS}
+        record['fpath'] = Path(datafile['fpath']).as_posix()
+        record['time'] = None if datafile.get('time') is None else format_time(datafile['time'])
+        if 'stat' in datafile:
+            record['size'], record['mtime'] = datafile['stat']
+
+        # other keys given by custom name parsers
+        extra = {
+            key: value for key, value in datafile.items()
+            if key not in COLUMNS + ['stat', 'bands'] and not (pd.api.types.is_scalar(value) and pd.isna(value))
+        }
+        record['extra'] = json.dumps(extra, default=str) if extra else None
+        return record
+
+    def add(self, datafiles):
+        """Add or update datafiles, identified by their path
+
+        Args:
+            datafiles (list or pandas.DataFrame): DataFile or dictionaries with at least fpath, and the bands mapping if any, or a table of parsed datafiles, see pyintdem.data.parse_files
+        """
+        if isinstance(datafiles, pd.DataFrame):
+            datafiles = datafiles.to_dict('records')
+
+        with self.connection:
+            for datafile in datafiles:
+                record = self._record(datafile)
+                self.connection.execute(
+                    f'INSERT INTO datafiles ({",".join(COLUMNS)}) VALUES ({",".join("?"*len(COLUMNS))}) '
+                    f'ON CONFLICT (fpath) DO UPDATE SET {",".join(f"{c}=excluded.{c}" for c in COLUMNS[1:] if c not in ["cloud", "valid"])}, '
+                    'cloud=COALESCE(excluded.cloud, cloud), valid=COALESCE(excluded.valid, valid)',
+                    [record[column] for column in COLUMNS]
+                )
+                (datafile_id,) = self.connection.execute(
+                    'SELECT id FROM datafiles WHERE fpath = ?', (record['fpath'],)
+                ).fetchone()
+                self.connection.execute('DELETE FROM bands WHERE datafile = ?', (datafile_id,))
+                self.connection.executemany(
+                    'INSERT INTO bands (datafile, name, path) VALUES (?, ?, ?)',
+                    [(datafile_id, name, str(path)) for name, path in datafile.get('bands', {}).items()]
+                )
+
+    def remove(self, fpaths):
+        """Remove datafiles and their bands
+
+        Args:
+            fpaths (list): Paths of the datafiles
+        """
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM datafiles WHERE fpath = ?',
+                [(Path(fpath).as_posix(),) for fpath in fpaths]
+            )
+
+    def set_statistics(self, fpath, cloud=None, valid=None):
+        """Set the cloud and validity statistics of a datafile, used in query
+
+        Args:
+            fpath (str): Path of the datafile
+            cloud (float, optional): Cloud cover, e.g., in percent. Defaults to None, unchanged.
+            valid (float, optional): Valid (non missing) pixels, e.g., in percent. Defaults to None, unchanged.
+        """
+        with self.connection:
+            self.connection.execute(
+                'UPDATE datafiles SET cloud = COALESCE(?, cloud), valid = COALESCE(?, valid) WHERE fpath = ?',
+                (cloud, valid, Path(fpath).as_posix())
+            )
+
+    def _select(self, columns, tile=None, start=None, end=None, mission=None, product=None, filetype=None, max_cloud=None, min_valid=None, times=None, tolerance='1h'):
+        conditions = []
+        params = []
+        for column, value in [('tile', tile), ('mission', mission), ('product', product), ('filetype', filetype)]:
+            if value is not None:
+                condition, values = _condition(f'd.{column}', value)
+                conditions.append(condition)
+                params += values
+        if start is not None:
+            conditions.append('d.time >= ?')
+            params.append(format_time(start))
+        if end is not None:
+            conditions.append('d.time <= ?')
+            params.append(format_time(end))
+        if max_cloud is not None:
+            conditions.append('d.cloud <= ?')
+            params.append(max_cloud)
+        if min_valid is not None:
+            conditions.append('d.valid >= ?')
+            params.append(min_valid)
+
+        join = ''
+        if times is not None:
+            # time intervals in a temporary table, joined on the time index
+            tolerance = pd.Timedelta(tolerance)
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS intervals (start TEXT, end TEXT)')
+            self.connection.execute('DELETE FROM intervals')
+            self.connection.executemany(
+                'INSERT INTO intervals VALUES (?, ?)',
+                [(format_time(pd.Timestamp(time) - tolerance), format_time(pd.Timestamp(time) + tolerance)) for time in times]
+            )
+            join = 'JOIN intervals i ON d.time BETWEEN i.start AND i.end'
+
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        return f'SELECT DISTINCT {columns} FROM datafiles d {join} {where} ORDER BY d.tile, d.time', params
+
+    def query(self, **kwargs):
+        """Select datafiles
+
+        Args:
+            tile (str or list, optional): Tile(s), e.g., T30TXR. Defaults to None.
+            start (datetime or str, optional): Start time, included. Defaults to None.
+            end (datetime or str, optional): End time, included. Defaults to None.
+            mission (str or list, optional): Mission(s), e.g., SENTINEL2A. Defaults to None.
+            product (str or list, optional): Product(s), e.g., L2A. Defaults to None.
+            filetype (str or list, optional): File type(s), theia or copernicus. Defaults to None.
+            max_cloud (float, optional): Maximum cloud cover. Defaults to None.
+            min_valid (float, optional): Minimum valid pixels. Defaults to None.
+            times (list, optional): Times of interest, e.g., low tides; datafiles within tolerance of any of them are selected. Defaults to None.
+            tolerance (str or timedelta, optional): Tolerance around times. Defaults to '1h'.
+
+        Returns:
+            pandas.DataFrame: Records of the datafiles, ordered by tile and time
+        """
+        sql, params = self._select(', '.join(f'd.{column}' for column in COLUMNS), **kwargs)
+        records = pd.read_sql_query(sql, self.connection, params=params)
+        records['time'] = pd.to_datetime(records['time'], format=TIME_FORMAT)
+        return records
+
+    def datafiles(self, **kwargs):
+        """Select datafiles with their bands, see query for the arguments
+
+        Returns:
+            list: Dictionaries of the datafiles, with fpath, time, stat, bands if mapped, ...
+        """
+        sql, params = self._select('d.id, ' + ', '.join(f'd.{column}' for column in COLUMNS), **kwargs)
+        rows = self.connection.execute(sql, params).fetchall()
+
+        bands = {}
+        ids = [row[0] for row in rows]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start+500]
+            for datafile_id, name, path in self.connection.execute(
+                f'SELECT datafile, name, path FROM bands WHERE datafile IN ({",".join("?"*len(chunk))})', chunk
+            ):
+                bands.setdefault(datafile_id, {})[name] = path
+
+        datafiles = []
+        for row in rows:
+            record = dict(zip(COLUMNS, row[1:]))
+            datafile = {
+                'filetype': record['filetype'],
+                'fpath': Path(record['fpath']),
+                'mission': record['mission'],
+                'product': record['product'],
+                'version': record['version'],
+                'time': None if record['time'] is None else pd.to_datetime(record['time'], format=TIME_FORMAT),
+                'tile': record['tile'],
+            }
+            if record['extra'] is not None:
+                datafile.update(json.loads(record['extra']))
+            if record['size'] is not None:
+                datafile['stat'] = [record['size'], record['mtime']]
+            # datafiles saved before mapping their bands are mapped on first use
+            if row[0] in bands:
+                datafile['bands'] = bands[row[0]]
+            datafiles.append(datafile)
+
+        return datafiles
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM datafiles').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -3,18 +3,965 @@
 
 import numpy as np
 from scipy import signal as sps
-from scipy.ndimage import measurements as scm
-from scipy.interpolate import RegularGridInterpolator
+from scipy import ndimage
 from osgeo import osr, gdal
+from pyproj import CRS, Transformer
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcl
-from netCDF4 import Dataset
-import copy
+from netCDF4 import Dataset, date2num
+import pandas as pd
 import warnings
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 gdal.UseExceptions()
 
+Window = namedtuple('Window', ['row', 'col', 'nrows', 'ncols'])
+
+# Working dtype of the floating point band data
+_dtype = np.dtype(np.float64)
+
+def set_dtype(dtype):
+    '''
+    Set the working dtype used for reading and for the band operations when
+    the data is not already floating point. Default is float64, float32
+    halves the memory and the memory bandwidth for the whole pipeline.
+
+    arguments:
+        dtype: numpy floating dtype like
+            np.float32 or np.float64
+    '''
+    global _dtype
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.floating):
+        raise ValueError('Working dtype must be a floating point dtype')
+    _dtype = dtype
+
+def get_dtype():
+    '''
+    Get the working dtype
+    '''
+    return(_dtype)
+
+def float_dtype(data):
+    '''
+    Floating point dtype to be used for results derived from data, which is the
+    dtype of data if already floating point, otherwise the working dtype.
+    '''
+    if np.issubdtype(data.dtype, np.floating):
+        return(data.dtype)
+    else:
+        return(_dtype)
+
+def read_raster(rband, dtype=None, window=None, shape=None, resampling='nearest', mask_nodata=False):
+    '''
+    Read the data of a gdal raster band.
+
+    arguments:
+        rband: gdal band
+            opened raster band
+        dtype: numpy dtype like or 'raw'
+            see `read_dtype`
+        window: Window
+            window to be read, default None reads the full band
+        shape: tuple
+            (row, col) shape of the returned data, the window is resampled
+            by gdal while reading. Default None keeps the window shape.
+        resampling: string
+            resampling method used with shape, one of nearest, bilinear,
+            cubic, cubicspline, lanczos, average and mode
+        mask_nodata: boolean
+            if True, the no data values of the file are set to np.nan for
+            floating point dtype, otherwise returned as nodata. Default False
+            returns the values of the file.
+
+    returns:
+        (data, nodata), nodata is None unless mask_nodata is True
+    '''
+    if window is None:
+        window = Window(0, 0, rband.YSize, rband.XSize)
+
+    if shape is None:
+        data = rband.ReadAsArray(window.col, window.row, window.ncols, window.nrows)
+    else:
+        algorithms = {
+            'nearest': 'NearestNeighbour',
+            'bilinear': 'Bilinear',
+            'cubic': 'Cubic',
+            'cubicspline': 'CubicSpline',
+            'lanczos': 'Lanczos',
+            'average': 'Average',
+            'mode': 'Mode'
+        }
+        try:
+            algorithm = getattr(gdal, 'GRIORA_' + algorithms[resampling])
+        except KeyError:
+            raise NotImplementedError('In read_raster: resampling {:s} not implemented'.format(resampling))
+
+        data = rband.ReadAsArray(
+            window.col, window.row, window.ncols, window.nrows,
+            buf_xsize=shape[1],
+            buf_ysize=shape[0],
+            resample_alg=algorithm
+        )
+
+    nodata = rband.GetNoDataValue() if mask_nodata else None
+    dtype = read_dtype(dtype)
+    if dtype is not None:
+        data = data.astype(dtype, copy=False)
+
+    if nodata is not None and np.issubdtype(data.dtype, np.floating):
+        if not np.isnan(nodata):
+            np.copyto(data, np.nan, where=data == nodata)
+        nodata = None
+
+    return(data, nodata)
+
+def read_dtype(dtype=None):
+    '''
+    Resolve the dtype argument of the reading functions. None gives the working
+    dtype, 'raw' keeps the dtype of the file.
+    '''
+    if dtype is None:
+        return(_dtype)
+    elif dtype == 'raw':
+        return(None)
+    else:
+        return(np.dtype(dtype))
+
+Scalar = (int, float, np.number)
+
+@lru_cache(maxsize=16)
+def get_transformer(projection, epsg, always_xy=False):
+    '''
+    Cached coordinate transformer from the projection (wkt) to epsg. The axis
+    order of the epsg definition is used, e.g., lat, lon for epsg 4326, unless
+    always_xy is True.
+    '''
+    try:
+        crs_in = CRS.from_wkt(projection)
+    except:
+        raise RuntimeError('problem with projection')
+
+    try:
+        crs_out = CRS.from_epsg(epsg)
+    except:
+        raise RuntimeError('problem with epsg')
+
+    return(Transformer.from_crs(crs_in, crs_out, always_xy=always_xy))
+
+def write_positions(fname, positions, header=['lat', 'lon'], chunksize=1000000):
+    '''
+    Write positions to a csv file, or a parquet file if fname ends with
+    .parquet, chunk by chunk.
+
+    arguments:
+        fname: string
+            file name
+        positions: array like or iterable of array like
+            (n, 2) array of positions, or an iterable of such arrays written
+            one after another
+        header: list
+            column names
+        chunksize: int
+            number of rows written at once
+    '''
+    fname = Path(fname)
+    if isinstance(positions, np.ndarray):
+        positions = (positions[i:i+chunksize] for i in range(0, max(len(positions), 1), chunksize))
+
+    if fname.suffix == '.parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('pyarrow is needed to write parquet files')
+
+        schema = pa.schema([(name, pa.float64()) for name in header])
+        with pq.ParquetWriter(fname.as_posix(), schema=schema) as writer:
+            for chunk in positions:
+                chunk = np.atleast_2d(chunk)
+                writer.write_table(
+                    pa.table({name:chunk[:, i] for i, name in enumerate(header)}, schema=schema)
+                )
+    else:
+        with open(fname, 'w') as f:
+            f.write(','.join(header) + '\n')
+            for chunk in positions:
+                np.savetxt(f, np.atleast_2d(chunk), fmt='%f', delimiter=',')
+
+def block_windows(shape, size=1024, overlap=0):
+    '''
+    Generate the windows to go through an array of given shape block by block.
+
+    arguments:
+        shape: tuple
+            (row, col) shape of the full array
+        size: int or tuple
+            block size in number of pixels, or (nrows, ncols) of the block
+        overlap: int
+            number of pixels added around each block, clipped at the edges
+
+    returns:
+        generator of (inner, outer) Window, where inner is the non-overlapping
+        part of the block and outer is the part to be read including overlap
+    '''
+    nrow, ncol = shape
+    if isinstance(size, (int, np.integer)):
+        brow, bcol = int(size), int(size)
+    else:
+        brow, bcol = int(size[0]), int(size[1])
+
+    for row in range(0, nrow, brow):
+        for col in range(0, ncol, bcol):
+            inner = Window(row, col, min(brow, nrow-row), min(bcol, ncol-col))
+            row0 = max(row-overlap, 0)
+            col0 = max(col-overlap, 0)
+            row1 = min(row+inner.nrows+overlap, nrow)
+            col1 = min(col+inner.ncols+overlap, ncol)
+            outer = Window(row0, col0, row1-row0, col1-col0)
+            yield inner, outer
+
+def scaled_geotransform(geotransform, shape, scaled_shape):
+    '''
+    Geotransform of data of shape resampled to scaled_shape over the same
+    extent, i.e., the pixel size is divided by the scaling factor.
+
+    arguments:
+        geotransform: tuple
+            gdal geotransform of the data
+        shape: tuple
+            (row, col) shape of the data
+        scaled_shape: tuple
+            (row, col) shape of the resampled data
+    '''
+    frow = scaled_shape[0]/shape[0]
+    fcol = scaled_shape[1]/shape[1]
+    return(
+        (
+            geotransform[0],
+            geotransform[1]/fcol,
+            geotransform[2]/frow,
+            geotransform[3],
+            geotransform[4]/fcol,
+            geotransform[5]/frow
+        )
+    )
+
+def block_geotransform(geotransform, window):
+    '''
+    Geotransform of the block defined by window within a raster with the given
+    geotransform.
+    '''
+    if geotransform is None:
+        return None
+
+    return (
+        geotransform[0] + window.col*geotransform[1] + window.row*geotransform[2],
+        geotransform[1],
+        geotransform[2],
+        geotransform[3] + window.col*geotransform[4] + window.row*geotransform[5],
+        geotransform[4],
+        geotransform[5]
+    )
+
+def retained_blobs(data, npixel, connectivity=1):
+    '''
+    Pixels of the blobs of nonzero data with at least npixel pixels.
+
+    arguments:
+        data: array like
+            data where the nonzero (including nan) values form the blobs
+        npixel: int
+            minimum number of pixels of the retained blobs
+        connectivity: int
+            1 for 4-connected blobs, 2 for 8-connected blobs
+
+    returns:
+        boolean array, True for the pixels of the retained blobs
+    '''
+    structure = ndimage.generate_binary_structure(2, connectivity)
+    labels, _ = ndimage.label(data, structure=structure)
+
+    # lookup table of the retained labels, label 0 is the background
+    count = np.bincount(labels.ravel())
+    retained = count >= npixel
+    retained[0] = False
+
+    return(retained[labels])
+
+def nan_footprint(mask, shape):
+    '''
+    Spread a boolean mask over the footprint of a kernel of the given shape,
+    aligned as scipy.signal.convolve2d(mode='same'). This is where the np.nan
+    values spread in the convolution.
+
+    arguments:
+        mask: array like
+            2D boolean array, e.g., np.isnan(data)
+        shape: tuple
+            shape of the kernel
+    '''
+    out = np.asarray(mask, dtype=bool)
+    for axis, size in enumerate(shape):
+        if size == 1:
+            continue
+        after = (size-1)//2
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (size-1-after, after)
+        padded = np.pad(out, pad)
+        out = np.zeros(shape=out.shape, dtype=bool)
+        for i in range(size):
+            index = [slice(None), slice(None)]
+            index[axis] = slice(i, i+out.shape[axis])
+            out |= padded[tuple(index)]
+    return(out)
+
+def shift_convolve(data, kernel, fillvalue=0, dtype=None):
+    '''
+    Convolution of 2D data with a small kernel, same as
+    scipy.signal.convolve2d(mode='same', boundary='fill'), by adding the
+    shifted data for each nonzero kernel weight. The np.nan values only spread
+    over the nonzero weights, see nan_footprint.
+
+    arguments:
+        data: array like
+            2D data array, boolean data can be used with an integer dtype
+        kernel: array like
+            2D kernel
+        fillvalue: float like
+            value outside the data
+        dtype: numpy dtype like
+            dtype of the result, default None uses the floating point dtype of
+            the data
+    '''
+    kernel = np.asarray(kernel)
+    if dtype is None:
+        dtype = float_dtype(np.asarray(data))
+    dtype = np.dtype(dtype)
+
+    nrows, ncols = data.shape
+    krows, kcols = kernel.shape
+    padded = np.pad(
+        np.asarray(data).astype(dtype, copy=False),
+        ((krows-1-(krows-1)//2, (krows-1)//2), (kcols-1-(kcols-1)//2, (kcols-1)//2)),
+        mode='constant',
+        constant_values=fillvalue
+    )
+
+    out = np.zeros(shape=(nrows, ncols), dtype=dtype)
+    scratch = None
+    for i in range(krows):
+        for j in range(kcols):
+            weight = kernel[i, j]
+            if weight == 0:
+                continue
+            shifted = padded[krows-1-i:krows-1-i+nrows, kcols-1-j:kcols-1-j+ncols]
+            if weight == 1:
+                out += shifted
+            elif weight == -1:
+                out -= shifted
+            else:
+                if scratch is None:
+                    scratch = np.empty_like(out)
+                np.multiply(shifted, dtype.type(weight), out=scratch)
+                out += scratch
+    return(out)
+
+def convolve(data, kernel, fillvalue=0, method='auto', nthreads=1, dtype=None):
+    '''
+    Convolution of 2D data with the same output as
+    scipy.signal.convolve2d(mode='same', boundary='fill'), including the
+    np.nan values spreading over the footprint of the kernel, with a choice of
+    backend.
+
+    arguments:
+        data: array like
+            2D data array
+        kernel: array like
+            2D kernel
+        fillvalue: float like
+            value outside the data, default 0
+        method: string
+            backend used for the convolution
+                direct - scipy.signal.convolve2d
+                shift - shift_convolve, fastest for boolean or integer data
+                ndimage - scipy.ndimage.convolve
+                fft - scipy.signal.fftconvolve, for large kernels, exact up
+                    to the floating point round-off
+                auto - shift if an integer dtype is given, e.g., for
+                    boolean data, fft from 100 kernel elements, ndimage
+                    otherwise
+            default auto
+        nthreads: int
+            number of threads, the data is split in row chunks with an
+            overlap of the kernel size. Default 1.
+        dtype: numpy dtype like
+            dtype of the result for the shift method, see shift_convolve
+
+    returns:
+        convoluted data: array like
+    '''
+    kernel = np.asarray(kernel)
+    if kernel.ndim != 2:
+        raise NotImplementedError('In convolve: kernel must be 2D')
+
+    if method=='auto':
+        if dtype is not None and np.issubdtype(dtype, np.integer):
+            method = 'shift'
+        elif kernel.size >= 100:
+            method = 'fft'
+        else:
+            method = 'ndimage'
+
+    krows, kcols = kernel.shape
+    pad = ((krows-1-(krows-1)//2, (krows-1)//2), (kcols-1-(kcols-1)//2, (kcols-1)//2))
+
+    def convolve_chunk(chunk):
+        if method=='direct':
+            # the nan spreading is done by convolve2d
+            return(sps.convolve2d(chunk, kernel, mode='same', boundary='fill', fillvalue=fillvalue))
+        elif method=='shift':
+            conv = shift_convolve(chunk, kernel, fillvalue=fillvalue, dtype=dtype)
+        elif method=='ndimage':
+            conv = ndimage.convolve(
+                chunk,
+                kernel.astype(float_dtype(chunk)),
+                output=float_dtype(chunk),
+                mode='constant',
+                cval=fillvalue,
+                origin=[size % 2 - 1 for size in kernel.shape]
+            )
+        elif method=='fft':
+            padded = np.pad(chunk.astype(float_dtype(chunk)), pad, mode='constant', constant_values=fillvalue)
+            np.copyto(padded, 0, where=np.isnan(padded))
+            conv = sps.fftconvolve(padded, kernel, mode='valid')
+        else:
+            raise NotImplementedError('In convolve: method {:s} not implemented'.format(method))
+
+        if np.issubdtype(chunk.dtype, np.floating):
+            inan = np.isnan(chunk)
+            if np.any(inan):
+                np.copyto(conv, np.nan, where=nan_footprint(inan, kernel.shape))
+        return(conv)
+
+    nrows = data.shape[0]
+    if nthreads <= 1 or nrows < 2*nthreads*krows:
+        return(convolve_chunk(data))
+
+    # row chunks with the kernel rows as overlap
+    chunksize = int(np.ceil(nrows/nthreads))
+    def convolve_rows(row):
+        start, end = max(0, row-krows), min(nrows, row+chunksize+krows)
+        return(convolve_chunk(data[start:end])[row-start:row-start+chunksize])
+
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        return(np.concatenate(list(executor.map(convolve_rows, range(0, nrows, chunksize)))))
+
+def compact_dtype(data):
+    '''
+    Compact gdal datatype to save data. Binary data (0, 1 and nan) is saved as
+    `gdal.GDT_Byte`, anything else as `gdal.GDT_Float32`.
+    '''
+    if np.issubdtype(data.dtype, np.bool_):
+        return(gdal.GDT_Byte)
+
+    values = data[np.logical_not(np.isnan(data))] if np.issubdtype(data.dtype, np.floating) else data
+    if np.all(np.logical_or(values == 0, values == 1)):
+        return(gdal.GDT_Byte)
+    else:
+        return(gdal.GDT_Float32)
+
+def geotiff_options(
+    dtype=gdal.GDT_Float32,
+    compress='DEFLATE',
+    tiled=True,
+    blocksize=512,
+    predictor='auto',
+    bigtiff='IF_SAFER',
+    num_threads='ALL_CPUS',
+    nbits=None,
+    cog=False):
+    '''
+    Creation options for the GTiff (or COG) gdal driver.
+
+    arguments:
+        dtype: gdal data type
+            datatype of the file, used for the automatic predictor
+        compress: string
+            compression, e.g., DEFLATE, ZSTD, LZW, None for no compression
+        tiled: boolean
+            tiled file instead of striped, always tiled for COG
+        blocksize: int
+            tile size
+        predictor: int or 'auto'
+            1 none, 2 horizontal differencing, 3 floating point. `auto` uses 3
+            for floating point data and none otherwise
+        bigtiff: string
+            YES, NO, IF_NEEDED, IF_SAFER
+        num_threads: int or string
+            number of threads for compression, ALL_CPUS for all
+        nbits: int
+            number of bits per pixel for GDT_Byte, e.g., 1 for binary data
+        cog: boolean
+            options for the COG driver
+
+    returns:
+        list of creation options
+    '''
+    options = []
+    if compress is not None:
+        options.append('COMPRESS={:s}'.format(compress))
+
+        if predictor == 'auto':
+            predictor = 3 if dtype in [gdal.GDT_Float32, gdal.GDT_Float64] else 1
+
+        if cog:
+            predictor = {1:'NO', 2:'STANDARD', 3:'FLOATING_POINT'}[int(predictor)]
+        options.append('PREDICTOR={}'.format(predictor))
+
+    if cog:
+        options.append('BLOCKSIZE={:d}'.format(blocksize))
+    elif tiled:
+        options.append('TILED=YES')
+        options.append('BLOCKXSIZE={:d}'.format(blocksize))
+        options.append('BLOCKYSIZE={:d}'.format(blocksize))
+
+    if bigtiff is not None:
+        options.append('BIGTIFF={:s}'.format(bigtiff))
+
+    if num_threads is not None:
+        options.append('NUM_THREADS={}'.format(num_threads))
+
+    if nbits is not None and not cog:
+        options.append('NBITS={:d}'.format(nbits))
+
+    return(options)
+
+def gdal_nodata(dtype):
+    '''
+    No data value used in files of gdal datatype, np.nan for floating point
+    and the maximum value for integers.
+    '''
+    if dtype in [gdal.GDT_Float32, gdal.GDT_Float64]:
+        return(np.nan)
+    else:
+        return({
+            gdal.GDT_Byte:255,
+            gdal.GDT_UInt16:65535,
+            gdal.GDT_Int16:32767,
+            gdal.GDT_UInt32:4294967295,
+            gdal.GDT_Int32:2147483647
+        }[dtype])
+
+def geotiff_nodata(arrays, dtype, nodata='auto', nbits=None):
+    '''
+    No data value of a file of gdal datatype.
+
+    arguments:
+        arrays: list of array like
+            data of the bands
+        dtype: gdal data type
+            datatype of the file
+        nodata: float like, None or 'auto'
+            `auto` uses `gdal_nodata` if the data has nan, and no value
+            otherwise, so that valid values equal to `gdal_nodata` (e.g.,
+            255 in a Byte file) are not masked. None never sets a value.
+        nbits: int
+            number of bits per pixel of the file, if any
+
+    returns:
+        no data value, or None
+
+    Raise a ValueError if the no data value does not fit in nbits.
+    '''
+    if isinstance(nodata, str) and nodata == 'auto':
+        if any(np.issubdtype(data.dtype, np.floating) and np.isnan(data).any() for data in arrays):
+            nodata = gdal_nodata(dtype)
+        else:
+            nodata = None
+
+    if nodata is not None and nbits is not None and not np.isnan(nodata) and not 0 <= nodata < 2**nbits:
+        raise ValueError('No data value {} does not fit in nbits={:d}'.format(nodata, nbits))
+
+    return(nodata)
+
+def to_gdal_array(data, nodata=None):
+    '''
+    Data to be written to a file, nan is replaced by the no data value.
+    '''
+    if nodata is not None and not np.isnan(nodata) and np.issubdtype(data.dtype, np.floating):
+        return(np.where(np.isnan(data), nodata, data))
+    else:
+        return(data)
+
+def write_geotiff(
+    fname,
+    arrays,
+    geotransform,
+    projection,
+    dtype=gdal.GDT_Float32,
+    nodata='auto',
+    cog=False,
+    overviews=None,
+    resampling='NEAREST',
+    **kwargs):
+    '''
+    Write arrays as bands of a GeoTiff file.
+
+    arguments:
+        fname: string
+            The filename to be saved
+        arrays: list of array like
+            data of the bands
+        geotransform: tuple
+            geotransform information
+        projection: string
+            projection information
+        dtype: gdal data type
+            Gdal datatype to be used for saving
+        nodata: float like, None or 'auto'
+            no data value replacing nan, see `geotiff_nodata`. Default `auto`
+            sets `gdal_nodata` only if the data has nan.
+        cog: boolean
+            save as Cloud Optimized GeoTiff with internal overviews
+        overviews: list of int
+            overview levels to be added to a regular GeoTiff, e.g. [2, 4, 8]
+        resampling: string
+            resampling method of the overviews, e.g. NEAREST, AVERAGE
+        kwargs:
+            creation options passed to `geotiff_options`
+    '''
+    fname = Path(fname).as_posix()
+    row, col = arrays[0].shape
+    options = geotiff_options(dtype=dtype, cog=cog, **kwargs)
+    nodata = geotiff_nodata(arrays, dtype, nodata=nodata, nbits=None if cog else kwargs.get('nbits'))
+
+    if cog:
+        driver = gdal.GetDriverByName('MEM')
+        gtiff = driver.Create('', col, row, len(arrays), dtype)
+    else:
+        driver = gdal.GetDriverByName('GTiff')
+        gtiff = driver.Create(fname, col, row, len(arrays), dtype, options=options)
+
+    gtiff.SetGeoTransform(geotransform)
+    gtiff.SetProjection(projection)
+    for i, data in enumerate(arrays):
+        band = gtiff.GetRasterBand(i+1)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        band.WriteArray(to_gdal_array(data, nodata))
+
+    if cog:
+        gdal.Translate(
+            fname,
+            gtiff,
+            format='COG',
+            creationOptions=options + ['OVERVIEWS=AUTO', 'RESAMPLING={:s}'.format(resampling)]
+        )
+    elif overviews is not None:
+        gtiff.BuildOverviews(resampling, overviews)
+
+    gtiff.FlushCache()
+    gtiff = None
+
+def _hsv_chunk(red, green, blue, channels, out):
+    '''
+    HSV conversion of a chunk of red, green and blue arrays, written in the
+    arrays of out for the requested channels. See rgb_to_hsv.
+    '''
+    value = np.maximum(red, green)
+    np.maximum(value, blue, out=value)
+    delta = np.minimum(red, green)
+    np.minimum(delta, blue, out=delta)
+    np.subtract(value, delta, out=delta)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if 'h' in channels:
+            # same order as matplotlib, blue then green then red maximum
+            hue = out['h']
+            bmax = blue == value
+            gmax = green == value
+            gmax &= np.logical_not(bmax)
+            np.subtract(green, blue, out=hue)
+            np.subtract(blue, red, out=hue, where=gmax)
+            np.subtract(red, green, out=hue, where=bmax)
+            np.true_divide(hue, delta, out=hue)
+            np.add(hue, 2, out=hue, where=gmax)
+            np.add(hue, 4, out=hue, where=bmax)
+            np.add(hue, 6, out=hue, where=hue < 0)
+            np.true_divide(hue, 6, out=hue)
+            np.copyto(hue, 0, where=delta == 0)
+
+        if 's' in channels:
+            saturation = out['s']
+            np.true_divide(delta, value, out=saturation)
+            np.copyto(saturation, 0, where=value == 0)
+
+    # np.maximum propagates nan, so value is nan if any of red, green, blue is
+    if 'h' in channels:
+        np.copyto(out['h'], np.nan, where=np.isnan(value))
+
+    if 'v' in channels:
+        out['v'][...] = value
+
+def rgb_to_hsv(red, green, blue, channels='hsv', chunksize=None, nthreads=1):
+    '''
+    Vectorized conversion of red, green and blue arrays to hue, saturation and
+    value, same as matplotlib.colors.rgb_to_hsv without the rgb cube. A np.nan
+    in any of red, green or blue gives np.nan in all channels. The conversion
+    is done chunk by chunk along the first axis, so that the scratch memory is
+    bounded by the chunk size.
+
+    arguments:
+        red, green, blue: array like
+            arrays of equal shape, values in 0 to 1
+        channels: string
+            channels to compute, any of 'h', 's' and 'v' in the order of the
+            returned arrays. Default 'hsv'.
+        chunksize: int
+            number of rows per chunk, default None uses about 64k pixels
+        nthreads: int
+            number of threads used for the chunks, default 1
+
+    returns:
+        tuple of arrays, one for each channel
+    '''
+    red, green, blue = np.atleast_1d(red, green, blue)
+    try:
+        assert red.shape == green.shape == blue.shape
+    except:
+        raise AssertionError('In rgb_to_hsv: arrays are not of equal size')
+    if not set(channels) <= set('hsv'):
+        raise NotImplementedError('In rgb_to_hsv: channels must be in hsv')
+
+    dtype = np.result_type(float_dtype(red), float_dtype(green), float_dtype(blue))
+    out = {channel: np.empty(shape=red.shape, dtype=dtype) for channel in channels}
+
+    if chunksize is None:
+        chunksize = max(1, 2**16//max(1, red[0].size))
+
+    def convert(row):
+        rows = slice(row, row+chunksize)
+        _hsv_chunk(
+            red[rows], green[rows], blue[rows], channels,
+            {channel: out[channel][rows] for channel in channels}
+        )
+
+    rows = range(0, red.shape[0], chunksize)
+    if nthreads > 1 and len(rows) > 1:
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            list(executor.map(convert, rows))
+    else:
+        for row in rows:
+            convert(row)
+
+    return(tuple(out[channel] for channel in channels))
+
+class BandStats(object):
+    def __init__(self, chunks=None, bins=2**16, range=None):
+        '''
+        Statistics of band data computed in one pass over the data, chunk by
+        chunk, with bounded memory. The moments are merged with the parallel
+        form of the Welford algorithm (Chan et al.), the median and the
+        percentiles are interpolated from a histogram of the data. The chunks
+        are consumed when the statistics are created, the statistics are then
+        a snapshot which does not change with the data.
+
+        arguments:
+            chunks: callable
+                returns an iterable of data arrays, e.g., the blocks of a band.
+                Default None, the data is then added with `update`.
+            bins: int
+                number of histogram bins for the median and percentiles.
+                Default 2**16.
+            range: tuple
+                (min, max) range of the histogram, values outside are ignored
+                in the histogram. The precision is then (max-min)/bins. Default
+                None follows the data range, the bins are merged by pairs when
+                the range grows, the precision is at worst 2*(max-min)/bins.
+
+        returns:
+            Band statistics: BandStats
+        '''
+        self.bins = bins
+        self.range = range
+
+        self.count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = np.inf
+        self._max = -np.inf
+        self._hist = np.zeros(self.bins, dtype=np.int64)
+        self._percentiles = {}
+
+        # start and width of the bins
+        if range is None:
+            self._start = None
+            self._width = None
+        else:
+            self._start = float(range[0])
+            self._width = (float(range[1]) - float(range[0]))/self.bins
+
+        if chunks is not None:
+            for data in chunks():
+                self.update(data)
+
+    @staticmethod
+    def _valid(data):
+        '''
+        Flat array of the non nan values of data
+        '''
+        data = np.asarray(data)
+        if np.issubdtype(data.dtype, np.floating):
+            return(data[np.logical_not(np.isnan(data))])
+        else:
+            return(data.ravel())
+
+    def _extend(self, vmin, vmax):
+        '''
+        Extend the histogram to contain vmin and vmax, merging the bins by
+        pairs, the new bin edges are edges of the previous bins.
+        '''
+        if self._start is None:
+            self._start = float(vmin)
+            self._width = max(float(vmax) - float(vmin), abs(float(vmin))*1e-9, 1e-12)/self.bins
+            return
+
+        end = max(float(vmax), self._start + self.bins*self._width)
+        factor = 1
+        while True:
+            width = factor*self._width
+            shift = max(0, int(np.ceil((self._start - vmin)/width)))
+            if self._start - shift*width + self.bins*width >= end:
+                break
+            factor *= 2
+
+        if shift or factor > 1:
+            index = shift + np.arange(self.bins)//min(factor, self.bins)
+            hist = np.zeros(self.bins, dtype=np.int64)
+            np.add.at(hist, index[index < self.bins], self._hist[index < self.bins])
+            self._hist = hist
+            self._start = self._start - shift*width
+            self._width = width
+
+    def update(self, data):
+        '''
+        Add a chunk of data to the statistics, np.nan values are ignored.
+
+        argument:
+            data: array like
+                data chunk
+        '''
+        values = self._valid(data)
+        n = values.size
+        if n == 0:
+            return
+        self._percentiles = {}
+
+        vmin, vmax = values.min(), values.max()
+        if self.range is None:
+            self._extend(vmin, vmax)
+            binned = values
+        else:
+            binned = values[np.logical_and(values >= self.range[0], values <= self.range[1])]
+        index = np.clip(((binned - self._start)/self._width).astype(np.int64), 0, self.bins-1)
+        self._hist += np.bincount(index, minlength=self.bins)
+
+        mean = values.mean(dtype=np.float64)
+        m2 = np.square(values - mean, dtype=np.float64).sum()
+
+        # merge with the previous chunks
+        count = self.count + n
+        delta = mean - self._mean
+        self._mean += delta*n/count
+        self._m2 += m2 + delta**2*self.count*n/count
+        self.count = count
+        self._min = min(self._min, vmin)
+        self._max = max(self._max, vmax)
+
+    @property
+    def min(self):
+        '''
+        Minimum value
+        '''
+        return(self._min if self.count else np.nan)
+
+    @property
+    def max(self):
+        '''
+        Maximum value
+        '''
+        return(self._max if self.count else np.nan)
+
+    @property
+    def mean(self):
+        '''
+        Mean value
+        '''
+        return(np.float64(self._mean) if self.count else np.nan)
+
+    @property
+    def var(self):
+        '''
+        Variance, with N degrees of freedom as np.nanvar
+        '''
+        return(np.float64(self._m2/self.count) if self.count else np.nan)
+
+    @property
+    def std(self):
+        '''
+        Standard deviation, with N degrees of freedom as np.nanstd
+        '''
+        return(np.sqrt(self.var))
+
+    @property
+    def median(self):
+        '''
+        Median value, see `percentile`
+        '''
+        return(self.percentile(50))
+
+    def histogram(self):
+        '''
+        Histogram of the data with `bins` bins.
+
+        returns:
+            hist, edges: as np.histogram
+        '''
+        if self._start is None:
+            return(self._hist.copy(), np.zeros(self.bins+1))
+
+        edges = self._start + self._width*np.arange(self.bins+1)
+        return(self._hist.copy(), edges)
+
+    def percentile(self, q):
+        '''
+        q-th percentile of the data, linearly interpolated in the histogram
+        bin and limited to the data range.
+
+        argument:
+            q: float
+                percentile, between 0 and 100
+        '''
+        if not self.count:
+            return(np.nan)
+
+        if q not in self._percentiles:
+            hist, edges = self.histogram()
+            if not np.any(hist):
+                return(np.nan)
+            cumulative = np.cumsum(hist)
+            rank = q/100*cumulative[-1]
+            i = min(np.searchsorted(cumulative, rank, side='right'), np.flatnonzero(hist)[-1])
+            fraction = np.clip((rank - cumulative[i] + hist[i])/hist[i], 0, 1)
+            value = edges[i] + fraction*(edges[i+1] - edges[i])
+            self._percentiles[q] = np.clip(value, self.min, self.max)
+
+        return(self._percentiles[q])
+
 class Band(object):
     def __init__(self, data=None, geotransform=None, projection=None, **kwargs):
         '''
@@ -36,27 +983,286 @@ class Band(object):
         self.projection = projection
         self.attrs = kwargs
 
-    def read(self, fname, band=1):
+        # missing value of integer data, see set_missing
+        self.nodata = None
+
+        # file backed band, see read(..., lazy=True), restricted to
+        # source_window of the file if given
+        self.source = None
+        self.source_window = None
+        self.mask_nodata = False
+        self.preprocess = None
+
+    def read(self, fname, band=1, lazy=False, dtype=None, factor=None, resampling='nearest', mask_nodata=False):
         '''
         Read band data from a file.
 
         arguments:
             fname: string, file location
             band: integer, band number
+            lazy: boolean
+                if True, only the file information is read and the data is
+                read block by block using `iter_blocks`
+            dtype: numpy dtype like or 'raw'
+                dtype of the data, default None uses the working dtype (see
+                `set_dtype`). 'raw' keeps the integer dtype of the file, and
+                the missing values are tracked with `nodata` until the data is
+                converted to floating point.
+            factor: float like
+                resolution factor applied while reading, e.g., 2 to read a 20m
+                band at 10m, see `upscale`. Default None reads the file
+                resolution. Not available with lazy.
+            resampling: string
+                gdal resampling used with factor, see `read_raster`
+            mask_nodata: boolean
+                if True, the no data values of the file are read as np.nan, or
+                as `nodata` for 'raw', e.g., for the compact masks saved by
+                `to_geotiff`. Default False reads the values of the file.
 
         Raise an exception if data can not be read.
 
         '''
+        if lazy and factor is not None:
+            raise NotImplementedError('In Band read: factor is not available with lazy')
 
         gdal.UseExceptions()
         try:
             dset = gdal.Open(fname, gdal.GA_ReadOnly)
             self.geotransform = dset.GetGeoTransform()
             self.projection = dset.GetProjectionRef()
-            self.data = dset.GetRasterBand(band).ReadAsArray().astype(float)
+            if lazy:
+                self.source = (fname, band, dtype)
+                self.source_window = None
+                self.mask_nodata = mask_nodata
+                self.data = None
+            elif factor is None:
+                self.source = None
+                self.data, self.nodata = read_raster(dset.GetRasterBand(band), dtype=dtype, mask_nodata=mask_nodata)
+            else:
+                self.source = None
+                shape = (dset.RasterYSize, dset.RasterXSize)
+                scaled_shape = (int(round(shape[0]*factor)), int(round(shape[1]*factor)))
+                self.data, self.nodata = read_raster(
+                    dset.GetRasterBand(band),
+                    dtype=dtype,
+                    shape=scaled_shape,
+                    resampling=resampling,
+                    mask_nodata=mask_nodata
+                )
+                self.geotransform = scaled_geotransform(self.geotransform, shape, scaled_shape)
+        except NotImplementedError:
+            raise
         except:
             raise Exception('Band: read error!')
 
+    @property
+    def data(self):
+        '''
+        2D data array of the band
+        '''
+        return(self._data)
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._stats = None
+
+    @property
+    def source(self):
+        '''
+        Source of a file backed band (fname, band number, dtype), or None
+        '''
+        return(self._source)
+
+    @source.setter
+    def source(self, source):
+        self._source = source
+        self._source_info = None
+
+    def _read_source_info(self):
+        '''
+        Shape and native block size of the source file, read once per source
+        '''
+        if self._source_info is None:
+            dset = gdal.Open(self.source[0], gdal.GA_ReadOnly)
+            bcol, brow = dset.GetRasterBand(self.source[1]).GetBlockSize()
+            self._source_info = ((dset.RasterYSize, dset.RasterXSize), (brow, bcol))
+        return(self._source_info)
+
+    @property
+    def dtype(self):
+        '''
+        dtype of the band data
+        '''
+        return(self.data.dtype)
+
+    def astype(self, dtype=None):
+        '''
+        Return a copy of the band with data converted to dtype. When converting
+        integer data to floating point, the `nodata` values are set to np.nan.
+
+        arguments:
+            dtype: numpy dtype like
+                target dtype, default None uses the working dtype
+        '''
+        if dtype is None:
+            dtype = _dtype
+
+        band = Band(
+            data=self.data.astype(dtype),
+            geotransform=self.geotransform,
+            projection=self.projection
+        )
+        if self.nodata is not None:
+            if np.issubdtype(band.data.dtype, np.floating):
+                band.data[self.data == self.nodata] = np.nan
+            else:
+                band.nodata = self.nodata
+
+        return(band)
+
+    def _values(self):
+        '''
+        Data to be used in the operations, integer data is converted to the
+        working dtype with the `nodata` values set to np.nan.
+        '''
+        if np.issubdtype(self.data.dtype, np.floating):
+            return(self.data)
+        elif self.nodata is not None:
+            return(self.astype(_dtype).data)
+        else:
+            return(self.data.astype(_dtype))
+
+    @property
+    def loaded(self):
+        '''
+        True if the band data is in memory
+        '''
+        return(self.data is not None)
+
+    @property
+    def shape(self):
+        '''
+        Shape of the band data, also available for file backed band
+        '''
+        if self.loaded:
+            return(self.data.shape)
+        elif self.source_window is not None:
+            return((self.source_window.nrows, self.source_window.ncols))
+        elif self.source is not None:
+            return(self._read_source_info()[0])
+        else:
+            return(None)
+
+    @property
+    def blocksize(self):
+        '''
+        Block size used for block processing. For a file backed band the native
+        block size of the file is used, enlarged to contain at least 1024 rows
+        and columns. Otherwise 1024.
+        '''
+        if self.source is None:
+            return((1024, 1024))
+
+        brow, bcol = self._read_source_info()[1]
+        brow = int(np.ceil(1024/brow)*brow)
+        bcol = int(np.ceil(1024/bcol)*bcol)
+        return((brow, bcol))
+
+    def read_window(self, window, rband=None):
+        '''
+        Read a window of a file backed band, preprocessed if needed.
+
+        arguments:
+            window: Window
+                Window to be read, relative to source_window if any
+            rband: gdal band
+                opened band of the source file, default None opens the file
+
+        returns:
+            Band of the window, the window is stored in attrs['window']
+        '''
+        fname, band, dtype = self.source
+        if rband is None:
+            try:
+                dset = gdal.Open(fname, gdal.GA_ReadOnly)
+                rband = dset.GetRasterBand(band)
+            except:
+                raise Exception('Band: read error!')
+
+        if self.source_window is None:
+            file_window = window
+        else:
+            file_window = Window(
+                window.row + self.source_window.row,
+                window.col + self.source_window.col,
+                window.nrows,
+                window.ncols
+            )
+        data, nodata = read_raster(rband, dtype=dtype, window=file_window, mask_nodata=self.mask_nodata)
+
+        block = Band(
+            data=data,
+            geotransform=block_geotransform(self.geotransform, window),
+            projection=self.projection,
+            window=window
+        )
+        block.nodata = nodata
+        if callable(self.preprocess):
+            block = self.preprocess(block)
+            block.attrs['window'] = window
+
+        return(block)
+
+    def _block(self, window):
+        '''
+        Band of a window of the in-memory data, the data is a view.
+        '''
+        block = Band(
+            data=self.data[window.row:window.row+window.nrows, window.col:window.col+window.ncols],
+            geotransform=block_geotransform(self.geotransform, window),
+            projection=self.projection,
+            window=window
+        )
+        block.nodata = self.nodata
+        return(block)
+
+    def iter_blocks(self, size=None, overlap=0):
+        '''
+        Iterate over the band block by block. For a file backed band (read with
+        lazy=True) only one block is kept in memory at a time.
+
+        arguments:
+            size: int or tuple
+                block size, default None uses `blocksize`
+            overlap: int
+                number of pixels added around each block
+
+        returns:
+            generator of (window, block), where window is the non-overlapping
+            Window of the block and block is a Band of the block including the
+            overlap. The read window is stored in block.attrs['window']. For
+            an in-memory band the block data is a view of the band data.
+        '''
+        if size is None:
+            size = self.blocksize
+
+        if self.loaded:
+            for inner, outer in block_windows(self.shape, size=size, overlap=overlap):
+                yield inner, self._block(outer)
+        elif self.source is not None:
+            fname, band, _ = self.source
+            try:
+                dset = gdal.Open(fname, gdal.GA_ReadOnly)
+                rband = dset.GetRasterBand(band)
+            except:
+                raise Exception('Band: read error!')
+
+            for inner, outer in block_windows(self.shape, size=size, overlap=overlap):
+                yield inner, self.read_window(outer, rband=rband)
+        else:
+            raise Exception('Band: no data to iterate over')
+
     def set_missing(self, value, to=np.nan):
         '''
         set the missing value in data from value 
@@ -66,11 +1272,18 @@ class Band(object):
                 Value to be replaced
             to: float like
                 Values replaced by to
+
+        For integer data, np.nan can not be stored. The value is then kept as
+        `nodata` and replaced by np.nan when converted to floating point.
         '''
-        if np.isnan(value):
-            self.data[np.isnan(self.data)] = to
+        if not np.issubdtype(self.data.dtype, np.floating) and np.isnan(to):
+            if not np.isnan(value):
+                self.nodata = value
+        elif np.isnan(value):
+            np.copyto(self.data, to, where=np.isnan(self.data))
         else:
-            self.data[self.data == value] = to
+            np.copyto(self.data, to, where=self.data == value)
+        self.invalidate()
 
     def upscale(self, factor, method='nearest'):
         '''
@@ -80,43 +1293,50 @@ class Band(object):
             factor: float like
                 Multiplication factor for upscaling the data resolution
             method: string
-                Method to be used for interpolation. Currently only nearest
-                neighbour is available.
-        '''
-        self.geotransform = (
-                self.geotransform[0],
-                self.geotransform[1]/float(factor),
-                self.geotransform[2],
-                self.geotransform[3],
-                self.geotransform[4],
-                self.geotransform[5]//float(factor)
-            )
-        if method=='nearest':
-            self.data = np.array(self.data.repeat(factor, axis=0).repeat(factor, axis=1))
-            return(True)
-        elif method=='linear':
-            nrows, ncols = self.data.shape
-            
-            # for original data
-            orig_r = np.linspace(0, nrows-1, nrows)
-            orig_c = np.linspace(0, ncols, ncols)
-
-            f = RegularGridInterpolator((orig_r, orig_c), self.data)
-
-            # for upscaled data
-            upscale_r = np.linspace(0, nrows-1, nrows*factor)
-            upscale_c = np.linspace(0, ncols-1, ncols*factor)
-
-            upscale_data = f(np.meshgrid(upscale_r, upscale_c))
-
-            self.data = upscale_data
-            return True
+                Method to be used for interpolation
+                    nearest - nearest neighbour, i.e., repeated pixels
+                    bilinear (or linear) - bilinear interpolation
+                    cubic - cubic spline interpolation
+                The interpolated pixels depending on a np.nan value are set
+                to np.nan.
+
+        The upscaled pixels cover the same extent as the original pixels, and
+        the geotransform is updated with the new pixel size.
+        '''
+        nrows, ncols = self.shape
+        if method=='nearest' and float(factor).is_integer():
+            # one allocation, the pixels are repeated through a 4D view
+            factor = int(factor)
+            data = np.empty(shape=(nrows*factor, ncols*factor), dtype=self.data.dtype)
+            data.reshape(nrows, factor, ncols, factor)[...] = self.data[:, None, :, None]
+        elif method in ['nearest', 'linear', 'bilinear', 'cubic']:
+            order = {'nearest': 0, 'linear': 1, 'bilinear': 1, 'cubic': 3}[method]
+            shape = (int(round(nrows*factor)), int(round(ncols*factor)))
+            zoom = (shape[0]/nrows, shape[1]/ncols)
+
+            values = self._values()
+            inan = np.isnan(values)
+            hasnan = np.any(inan)
+            if hasnan:
+                values = np.where(inan, values.dtype.type(self.mean), values)
+
+            data = ndimage.zoom(values, zoom, order=order, mode='nearest', grid_mode=True)
+            if hasnan:
+                inan = ndimage.zoom(inan.astype(np.float32), zoom, order=min(order, 1), mode='nearest', grid_mode=True)
+                np.copyto(data, np.nan, where=inan > 0)
+            self.nodata = None
         else:
             raise NotImplementedError
 
-    def normalize(self, method='minmax', std_factor=0.5, std_correction='high', perc_threshold=95):
+        if self.geotransform is not None:
+            self.geotransform = scaled_geotransform(self.geotransform, (nrows, ncols), data.shape)
+        self.data = data
+        return(True)
+
+    def normalize(self, method='minmax', std_factor=0.5, std_correction='high', perc_threshold=95, out=None):
         '''
-        normalize the data using a given method.
+        normalize the data using a given method. The data is normalized in
+        place, or in out if given.
 
         argument:
             method: string
@@ -133,35 +1353,65 @@ class Band(object):
                     high - higher tail
             perc_threshold: float
                 perc_threshold to be used for `perc` method
-        '''
+            out: array like or Band
+                preallocated floating point array where the normalized data is
+                written, which then becomes the band data. Default None.
+        '''
+        # statistics of the values before normalization
+        stats = self.stats
+        if method=='perc':
+            pth = self.percentile(perc_threshold)
+
+        if out is not None:
+            if isinstance(out, Band):
+                out.invalidate()
+                out = out.data
+            np.copyto(out, self._values())
+            self.data = out
+            self.nodata = None
+        elif not np.issubdtype(self.data.dtype, np.floating):
+            # integer data is converted to the working dtype
+            self.data = self._values()
+            self.nodata = None
+
+        # the min and max after capping follow from the statistics
+        ftype = self.data.dtype.type
+        vmin, vmax = ftype(stats.min), ftype(stats.max)
+
         if method=='minmax':
-            self.data = (self.data - np.nanmin(self.data))/(np.nanmax(self.data)-np.nanmin(self.data))
-            return(True)
+            pass
 
         elif method=='std':
-            mu = np.nanmean(self.data)
-            std = np.nanstd(self.data)
+            low = ftype(stats.mean-std_factor*stats.std)
+            high = ftype(stats.mean+std_factor*stats.std)
 
+            # np.minimum and np.maximum keep the nan values
             if std_correction=='both':
-                self.data[np.logical_and(self.data<(mu-std_factor*std), np.logical_not(np.isnan(self.data)))] = mu-std_factor*std
-                self.data[np.logical_and(self.data>(mu+std_factor*std), np.logical_not(np.isnan(self.data)))] = mu+std_factor*std
+                np.maximum(self.data, low, out=self.data)
+                np.minimum(self.data, high, out=self.data)
+                vmin, vmax = min(max(vmin, low), high), min(max(vmax, low), high)
             elif std_correction=='low':
-                self.data[np.logical_and(self.data<(mu-std_factor*std), np.logical_not(np.isnan(self.data)))] = mu-std_factor*std
+                np.maximum(self.data, low, out=self.data)
+                vmin, vmax = max(vmin, low), max(vmax, low)
             elif std_correction=='high':
-                self.data[np.logical_and(self.data>(mu+std_factor*std), np.logical_not(np.isnan(self.data)))] = mu+std_factor*std
+                np.minimum(self.data, high, out=self.data)
+                vmin, vmax = min(vmin, high), min(vmax, high)
             else:
                 raise NotImplementedError
 
-            self.data = (self.data - np.nanmin(self.data))/(np.nanmax(self.data)-np.nanmin(self.data))
-
         elif method=='perc':
-            pth = np.nanpercentile(self.data, perc_threshold)
-            self.data[np.logical_and(self.data>pth, np.logical_not(np.isnan(self.data)))] = pth
-            self.data = (self.data - np.nanmin(self.data))/(np.nanmax(self.data)-np.nanmin(self.data))
+            pth = ftype(pth)
+            np.minimum(self.data, pth, out=self.data)
+            vmin, vmax = min(vmin, pth), min(vmax, pth)
         else:
             raise NotImplementedError
 
-    def mask(self, by, inverse=False):
+        np.subtract(self.data, vmin, out=self.data)
+        np.true_divide(self.data, vmax-vmin, out=self.data)
+        self.invalidate()
+        return(True)
+
+    def mask(self, by, inverse=False, inplace=False):
         '''
         Apply a mask 'by' on the band data - keeping the values presented by 1
         in mask 'by'. Set inverse to True for inversing masking.
@@ -171,63 +1421,140 @@ class Band(object):
                 Mask band
             inverse: boolean
                 Inverse masking
+            inplace: boolean
+                mask the band data in place and return the band itself,
+                instead of a masked copy
 
         TODO: size check
         '''
-        _data = copy.deepcopy(self.data)
-        if isinstance(by, Band):
+        if not isinstance(by, Band):
+            raise NotImplementedError('In mask: mask must be a Band type')
+
+        if isinstance(by, MaskBand):
+            if inverse:
+                remove = np.logical_or(by.values, np.logical_not(by.valid))
+            else:
+                remove = np.logical_not(by.values)
+        else:
+            byvalues = by._values()
             if inverse:
                 # set what is in the mask to np.nan
-                _data[by.data.astype(bool)] = np.nan
+                remove = byvalues.astype(bool)
             else:
                 # set what is not in the mask to np.nan
-                by = by.logical_not()
-                _data[by.data.astype(bool)] = np.nan
-
+                remove = byvalues == 0
+                remove |= np.isnan(byvalues)
+
+        if inplace:
+            if not np.issubdtype(self.data.dtype, np.floating):
+                self.data = self._values()
+                self.nodata = None
+            np.copyto(self.data, np.nan, where=remove)
+            self.invalidate()
+            return(self)
+        else:
+            values = self._values()
             return(
                 Band(
-                    data=_data,
+                    data=np.where(remove, values.dtype.type(np.nan), values),
                     geotransform=self.geotransform,
                     projection=self.projection
                 )
             )
-        else:
-            raise NotImplementedError('In mask: mask must be a Band type')
+
+    def statistics(self, bins=2**16, range=None, size=None):
+        '''
+        Compute the statistics of the band data in one pass, block by block,
+        see BandStats. The statistics are cached in `stats` until the band
+        data is changed.
+
+        arguments:
+            bins: int
+                number of histogram bins for the median and percentiles,
+                default 2**16
+            range: tuple
+                (min, max) range of the histogram, default None
+            size: int or tuple
+                block size, default None uses `blocksize` for a file backed
+                band and chunks of about 1 million pixels otherwise
+
+        returns:
+            Band statistics: BandStats
+        '''
+        if size is None:
+            if self.loaded:
+                ncols = self.shape[1]
+                size = (max(1, 2**20//ncols), ncols)
+            else:
+                size = self.blocksize
+
+        self._stats = BandStats(
+            chunks=lambda: (block._values() for _, block in self.iter_blocks(size=size)),
+            bins=bins,
+            range=range
+        )
+        return(self._stats)
+
+    @property
+    def stats(self):
+        '''
+        Cached statistics of the band data, see `statistics`
+        '''
+        if self._stats is None:
+            self.statistics()
+        return(self._stats)
+
+    def invalidate(self):
+        '''
+        Clear the cached statistics, needed after changing the band data
+        directly, e.g., band.data[0, 0] = 1
+        '''
+        self._stats = None
 
     @property
     def min(self):
         '''
         Minimum value of the band data
         '''
-        return(np.nanmin(self.data))
+        return(self.stats.min)
 
     @property
     def max(self):
         '''
         Maximum value of the band data
         '''
-        return(np.nanmax(self.data))
+        return(self.stats.max)
 
     @property
     def mean(self):
         '''
         Mean value of the band data
         '''
-        return(np.nanmean(self.data))
+        return(self.stats.mean)
 
     @property
     def std(self):
         '''
         Standard deviation of the band data
         '''
-        return(np.nanstd(self.data))
+        return(self.stats.std)
+
+    def percentile(self, q):
+        '''
+        q-th percentile of the band data, exact (np.nanpercentile) for an
+        in-memory band, from the histogram of `stats` for a file backed band
+        '''
+        if self.loaded:
+            return(np.nanpercentile(self._values(), q))
+        else:
+            return(self.stats.percentile(q))
 
     @property
     def median(self):
         '''
-        Median of the band data
+        Median of the band data, see `percentile`
         '''
-        return(np.nanmedian(self.data))
+        return(self.percentile(50))
 
     def convolute(
         self, 
@@ -236,7 +1563,9 @@ class Band(object):
         replacevalue=np.nan, 
         fillvalue=0, 
         nanmask=True,
-        cleanedge=True):
+        cleanedge=True,
+        method='auto',
+        nthreads=1):
         '''
         Convolute the data with the given kernel.
         
@@ -257,16 +1586,22 @@ class Band(object):
                 higher than 1 to unity.
             cleanedge: boolean
                 set valus of two edge row and column to np.nan
+            method: string
+                convolution backend, see `convolve`. Default is auto
+            nthreads: int
+                number of threads used for the convolution. Default is 1
 
         returns:
             Convoluted band: Band
+
+        For a binary band, `edges` is faster than the Laplacian kernel.
         '''
         kernel = np.array(kernel)
 
         if replacenan:
             self.set_missing(value=np.nan, to=replacevalue)
 
-        conv = sps.convolve2d(self.data, kernel, mode='same', boundary='fill', fillvalue=0)
+        conv = convolve(self._values(), kernel, fillvalue=fillvalue, method=method, nthreads=nthreads)
         
         if nanmask:
             conv[conv<1] = np.nan
@@ -288,7 +1623,48 @@ class Band(object):
             )
         )
 
-    def position(self, xyloc, epsg=4326, center=True, saveto=None):
+    def edges(self, connectivity=1, fillvalue=0, cleanedge=True, nthreads=1):
+        '''
+        Edge pixels of a binary band, i.e., the pixels of value 1 with at least
+        one neighbour of value 0. Same as convolute with the Laplacian kernel
+        and nanmask, computed on the boolean values.
+
+        arguments:
+            connectivity: int
+                1 for the 4 neighbours Laplacian, 2 for the 8 neighbours
+            fillvalue: np.float like
+                value outside the data. Default is 0
+            cleanedge: boolean
+                remove the two edge rows and columns
+            nthreads: int
+                number of threads used for the convolution. Default is 1
+
+        returns:
+            Edge mask: MaskBand
+        '''
+        if connectivity==1:
+            kernel = [[0, -1, 0], [-1, 4, -1], [0, -1, 0]]
+        elif connectivity==2:
+            kernel = [[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]]
+        else:
+            raise NotImplementedError('In Band edges: connectivity must be 1 or 2')
+
+        if isinstance(self, MaskBand):
+            band = self
+        else:
+            band = MaskBand(data=self._values(), geotransform=self.geotransform, projection=self.projection)
+
+        return(
+            band.convolute(
+                kernel=kernel,
+                fillvalue=fillvalue,
+                nanmask=True,
+                cleanedge=cleanedge,
+                nthreads=nthreads
+            )
+        )
+
+    def position(self, xyloc, epsg=4326, center=True, saveto=None, chunksize=1000000):
         '''
         Return the position of the given pixel location by array of x,y in xyloc
         lon lat position.
@@ -299,85 +1675,201 @@ class Band(object):
         In the image sense, xyloc is actually switched position in the geographic
         sense, i.e., xyloc is in row, column model, where as geographic coordinate
         is in column row model.
+
+        The pixels are transformed in batches of chunksize with a cached
+        transformer. If saveto is given, the positions are written batch by
+        batch to a csv file, or a parquet file for the .parquet extension.
         '''
         # Switching from matrix to geograpic location
         yi = np.array(xyloc[0]) # row location
         xi = np.array(xyloc[1]) # column location
 
         try:
-            crs_in = osr.SpatialReference()
-            crs_in.ImportFromWkt(self.projection)
-        except:
-            raise RuntimeError('In Band.position(): problem with projection')
+            transformer = get_transformer(self.projection, epsg)
+        except RuntimeError as e:
+            raise RuntimeError('In Band.position(): {}'.format(e))
+
+        def transform(yi, xi):
+            # Position of pixel in source coordinate
+            x = self.geotransform[0] + xi*self.geotransform[1] + yi*self.geotransform[2]
+            if center:
+                x = x + self.geotransform[1]/float(2) # Shifting half pixel for center
+
+            y = self.geotransform[3] + yi*self.geotransform[5] + xi*self.geotransform[4]
+            if center:
+                y = y + self.geotransform[5]/float(2)
+
+            # Transformed position of pixels
+            return(np.column_stack(transformer.transform(x, y)))
+
+        if np.ndim(xi) == 0:
+            xyout = tuple(transform(yi, xi)[0])
+        elif saveto is None:
+            xyout = transform(yi, xi)
+        else:
+            chunks = (
+                transform(yi[i:i+chunksize], xi[i:i+chunksize])
+                for i in range(0, max(len(xi), 1), chunksize)
+            )
+            write_positions(fname=saveto, positions=chunks, header=['lat', 'lon'])
+            return
 
-        try:
-            crs_out = osr.SpatialReference()
-            crs_out.ImportFromEPSG(epsg)
-        except:
-            raise RuntimeError('In Band.position(): problem with epsg')
+        if saveto is None:
+            return(xyout)
         else:
-            transformer = osr.CoordinateTransformation(crs_in, crs_out)
+            write_positions(fname=saveto, positions=np.atleast_2d(xyout), header=['lat', 'lon'])
 
-        # Position of pixel in source coordinate
-        x = self.geotransform[0] + xi*self.geotransform[1] + yi*self.geotransform[2]
-        if center:
-            x = x + self.geotransform[1]/float(2) # Shifting half pixel for center
-        
-        y = self.geotransform[3] + yi*self.geotransform[5] + xi*self.geotransform[4]
-        if center:
-            y = y + self.geotransform[5]/float(2)
+    def shoreline_pixels(self, connectivity=1, fillvalue=0, cleanedge=True, chunksize=None, saveto=None, epsg=4326):
+        '''
+        Shoreline pixels of a binary band, i.e., the pixels of `edges`, found
+        row chunk by row chunk without the full size edge band. A file backed
+        band is read chunk by chunk.
 
-        # Transformed position of pixels
-        try:
-            assert zip(x, y)
-        except:
-            xyout = transformer.TransformPoint(x, y)[0:2]
+        arguments:
+            connectivity: int
+                1 for the 4 neighbours Laplacian, 2 for the 8 neighbours
+            fillvalue: np.float like
+                value outside the data. Default is 0
+            cleanedge: boolean
+                remove the two edge rows and columns
+            chunksize: int
+                number of rows per chunk, default None uses about 1 million
+                pixels
+            saveto: string
+                if given, the positions of the pixels are written chunk by
+                chunk to a csv file, or a parquet file, see `position`
+            epsg: epsg code
+                epsg code of the saved positions. Default 4326
+
+        returns:
+            (row, column) arrays of the shoreline pixels in row order, as
+            np.where, to be used in `position`. None if saveto is given.
+        '''
+        nrows, ncols = self.shape
+        if chunksize is None:
+            chunksize = max(1, 2**20//ncols)
+
+        def chunks():
+            for row in range(0, nrows, chunksize):
+                # one row of overlap for the neighbours
+                start, end = max(0, row-1), min(nrows, row+chunksize+1)
+                window = Window(start, 0, end-start, ncols)
+                if self.loaded:
+                    block = self._block(window)
+                else:
+                    block = self.read_window(window)
+
+                edges = block.edges(connectivity=connectivity, fillvalue=fillvalue, cleanedge=False)
+                rows, cols = np.nonzero(edges.values[row-start:row-start+chunksize])
+                rows += row
+                if cleanedge:
+                    keep = (rows >= 2) & (rows < nrows-2) & (cols >= 2) & (cols < ncols-2)
+                    rows, cols = rows[keep], cols[keep]
+                yield rows, cols
+
+        if saveto is None:
+            rows, cols = zip(*chunks())
+            return((np.concatenate(rows), np.concatenate(cols)))
         else:
-            xyout = np.array([transformer.TransformPoint(xx, yy)[0:2] for xx,yy in zip(x, y)])
-        finally:
-            if saveto is None:
-                return(xyout)
-            else:
-                np.savetxt(
-                    fname=saveto, 
-                    X=xyout, 
-                    fmt='%f', 
-                    delimiter=',',
-                    comments='',
-                    header='lat,lon'
-                )
+            write_positions(
+                fname=saveto,
+                positions=(self.position(xyloc=xyloc, epsg=epsg, center=True) for xyloc in chunks()),
+                header=['lat', 'lon']
+            )
 
-    def clean(self, npixel, fillvalue, background=False):
+    def shoreline_lines(self, level=0.5, nthreads=1, saveto=None, epsg=4326, chunksize=1000000):
         '''
-        Clean the image below given pixel blob size (number of pixels) grouped
-        together. If background, the data will be reversed in first step.
-        Finally it returns a clean band.
+        Shoreline as polylines traced by marching squares (contourpy) at the
+        given level of the band data. On a binary band the lines pass between
+        the pixels of value 0 and 1, on a continuous band, e.g., a water index,
+        the lines are interpolated at sub-pixel precision. np.nan values are
+        masked.
 
-        argument:
-            npixel: int like
-                number of pixel to be use as the blob size
-            fillvalue: float like
-                value to be used on the selected blobs
+        arguments:
+            level: float
+                contour level. Default 0.5
+            nthreads: int
+                number of threads, the lines are then split at the boundaries
+                of the nthreads chunks. Default 1
+            saveto: string
+                if given, the positions of the line vertices are written to a
+                csv file, or a parquet file, with the line number, in chunks of
+                about chunksize vertices
+            epsg: epsg code
+                epsg code of the saved positions. Default 4326
+            chunksize: int
+                number of vertices transformed and written at once
+
+        returns:
+            list of (n, 2) arrays of (row, column) of the line vertices, to be
+            used in `position`. None if saveto is given.
+        '''
+        try:
+            import contourpy
+        except ImportError:
+            raise ImportError('contourpy is needed to trace the shoreline lines')
+
+        if nthreads > 1:
+            generator = contourpy.contour_generator(
+                z=np.ma.masked_invalid(self._values(), copy=False),
+                name='threaded',
+                line_type=contourpy.LineType.Separate,
+                chunk_count=nthreads,
+                thread_count=nthreads
+            )
+        else:
+            generator = contourpy.contour_generator(
+                z=np.ma.masked_invalid(self._values(), copy=False),
+                line_type=contourpy.LineType.Separate
+            )
+
+        # contourpy vertices are (x, y), i.e., (column, row)
+        lines = [line[:, ::-1] for line in generator.lines(level)]
+        if saveto is None:
+            return(lines)
+
+        def chunks():
+            start = 0
+            while start < len(lines):
+                end, count = start, 0
+                while end < len(lines) and count < chunksize:
+                    count += len(lines[end])
+                    end += 1
+                vertices = np.concatenate(lines[start:end])
+                number = np.repeat(np.arange(start, end), [len(line) for line in lines[start:end]])
+                positions = self.position(xyloc=(vertices[:, 0], vertices[:, 1]), epsg=epsg, center=True)
+                yield np.column_stack([number, positions])
+                start = end
+
+        write_positions(fname=saveto, positions=chunks(), header=['line', 'lat', 'lon'])
+
+    def clean(self, npixel, fillvalue, background=False, connectivity=1):
+        '''
+        Clean the image below given pixel blob size (number of pixels) grouped
+        together. If background, the data will be reversed in first step.
+        Finally it returns a clean band.
+
+        argument:
+            npixel: int like
+                number of pixel to be use as the blob size
+            fillvalue: float like
+                value to be used on the selected blobs
             background: boolean
                 if background=True, the data will be reversed at the first step
                 before applying the npixel blobs and then filled with fillvalue
+            connectivity: int
+                1 for 4-connected blobs (default), 2 for 8-connected blobs
         '''
         inan = np.isnan(self.data)
         if background:
-            data = np.zeros(shape=self.data.shape)
-            labels, _ = scm.label(self.data)
+            data = np.zeros(shape=self.shape, dtype=float_dtype(self.data))
+            retained = retained_blobs(self.data, npixel=npixel, connectivity=connectivity)
         else:
-            data = np.ones(shape=self.data.shape)
-            labels, _ = scm.label(np.nanmax(self.data)-self.data)
-        
-        _, count = np.unique(labels, return_counts=True)
-        retained_labels = np.argwhere(count>=npixel).ravel()
-        retained_labels = retained_labels[retained_labels>0]
+            data = np.ones(shape=self.shape, dtype=float_dtype(self.data))
+            retained = retained_blobs(np.nanmax(self.data)-self.data, npixel=npixel, connectivity=connectivity)
 
-        for label in retained_labels:
-            data[labels==label] = fillvalue
-
-        data[inan] = np.nan
+        np.copyto(data, fillvalue, where=retained)
+        np.copyto(data, np.nan, where=inan)
 
         return(
             Band(
@@ -391,34 +1883,47 @@ class Band(object):
         '''
         Print representation
         '''
-        return('{:d} - {:d}'.format(self.data.shape[0], self.data.shape[1]))
+        return('{:d} - {:d}'.format(self.shape[0], self.shape[1]))
+
+    def lazy(self):
+        '''
+        Return a lazy expression of the band. The operators on the expression
+        build an expression tree, which is evaluated in a single pass, chunk by
+        chunk, by `Expression.compute()` without full size intermediate arrays.
+
+        example:
+            red = (red.lazy()*alpha + (alpha.lazy()*-1+1)).compute()
+        '''
+        return(Expression(op='band', args=[self], like=self))
 
     def __add__(self, other):
         '''
         Return a modified band with another band data or value added to the
         current band data.
         '''
-        if isinstance(other, (int, float)):
+        if isinstance(other, Scalar):
             return(
                 Band(
-                    data=self.data+float(other),
+                    data=self._values()+float(other),
                     geotransform=self.geotransform,
                     projection=self.projection
                 )
             )
         elif isinstance(other, Band):
             try:
-                assert np.all(self.data.shape==other.data.shape)
+                assert np.all(self.shape==other.shape)
             except:
                 raise AssertionError('In Band add: size mismatch')
             else:
                 return(
                     Band(
-                        data=self.data+other.data,
+                        data=self._values()+other._values(),
                         geotransform=self.geotransform,
                         projection=self.projection
                     )
                 )
+        elif isinstance(other, Expression):
+            return(self.lazy().__add__(other))
         else:
             raise NotImplementedError('In Band add: other datatype not implemented')
 
@@ -427,37 +1932,39 @@ class Band(object):
         Return a modified band with another band data or value added to the
         current band data.
         '''
-        if isinstance(other, (int, float)):
+        if isinstance(other, Scalar):
             return(Band.__add__(self, other))
         else:
-            raise NotImplementedError('In Band radd: only int and float is implemented')
+            raise NotImplementedError('In Band radd: only scalar is implemented')
 
     def __sub__(self, other):
         '''
         Return a modified band with another band data or value subtracted from
         the current band data.
         '''
-        if isinstance(other, (int, float)):
+        if isinstance(other, Scalar):
             return(
                 Band(
-                    data=self.data-float(other),
+                    data=self._values()-float(other),
                     geotransform=self.geotransform,
                     projection=self.projection
                 )
             )
         elif isinstance(other, Band):
             try:
-                assert np.all(self.data.shape==other.data.shape)
+                assert np.all(self.shape==other.shape)
             except:
                 raise AssertionError('In Band sub: size mismatch')
             else:
                 return(
                     Band(
-                        data=self.data-other.data,
+                        data=self._values()-other._values(),
                         geotransform=self.geotransform,
                         projection=self.projection
                     )
                 )
+        elif isinstance(other, Expression):
+            return(self.lazy().__sub__(other))
         else:
             raise NotImplementedError('In Band sub: other datatype not implemented')
 
@@ -466,37 +1973,39 @@ class Band(object):
         Return a modified band with another band data or value subtracted from
         the current band data.
         '''
-        if isinstance(other, (int, float)):
-            return(Band.__sub__(self, other))
+        if isinstance(other, Scalar):
+            return(Band.__add__(Band.__mul__(self, -1), other))
         else:
-            raise NotImplementedError('In Band rsub: only int and float is implemented')
+            raise NotImplementedError('In Band rsub: only scalar is implemented')
     
     def __mul__(self, other):
         '''
         Return a modified band with another band data or value multiplied to the
         current band data.
         '''
-        if isinstance(other, (int, float)):
+        if isinstance(other, Scalar):
             return(
                 Band(
-                    data=self.data*float(other),
+                    data=self._values()*float(other),
                     geotransform=self.geotransform,
                     projection=self.projection
                 )
             )
         elif isinstance(other, Band):
             try:
-                assert np.all(self.data.shape==other.data.shape)
+                assert np.all(self.shape==other.shape)
             except:
                 raise AssertionError('In Band mul: size mismatch')
             else:
                 return(
                     Band(
-                        data=self.data*other.data,
+                        data=self._values()*other._values(),
                         geotransform=self.geotransform,
                         projection=self.projection
                     )
                 )
+        elif isinstance(other, Expression):
+            return(self.lazy().__mul__(other))
         else:
             raise NotImplementedError('In Band mul: other datatype not implemented')
 
@@ -505,225 +2014,248 @@ class Band(object):
         Return a modified band with another band data or value dividing the
         current band data.
         '''
-        if isinstance(other, (int, float)):
+        if isinstance(other, Scalar):
             return(
                 Band(
-                    data=self.data/float(other),
+                    data=self._values()/float(other),
                     geotransform=self.geotransform,
                     projection=self.projection
                 )
             )
         elif isinstance(other, Band):
             try:
-                assert np.all(self.data.shape==other.data.shape)
+                assert np.all(self.shape==other.shape)
             except:
                 raise AssertionError('In Band div: size mismatch')
             else:
                 return(
                     Band(
-                        data=self.data/other.data,
+                        data=self._values()/other._values(),
                         geotransform=self.geotransform,
                         projection=self.projection
                     )
                 )
+        elif isinstance(other, Expression):
+            return(self.lazy().__truediv__(other))
         else:
             raise NotImplementedError('In Band div: other datatype not implemented')
 
-    def __gt__(self, other):
+    def _inplace(self, ufunc, other, name):
         '''
-        Return a modified logical band which is true if the values are greater
-        than the other and false if otherwise.
+        Apply ufunc on the band data in place with another band data or value.
         '''
-        if isinstance(other, (int, float)):
-            _data = self.data>float(other)
-            _data = _data.astype(float)
-            _data[np.isnan(self.data)] = np.nan
-            return(
-                Band(
-                    data=_data,
-                    geotransform=self.geotransform,
-                    projection=self.projection
-                )
-            )
+        if not np.issubdtype(self.data.dtype, np.floating):
+            self.data = self._values()
+            self.nodata = None
+        self.invalidate()
+
+        if isinstance(other, Scalar):
+            ufunc(self.data, float(other), out=self.data)
         elif isinstance(other, Band):
             try:
-                assert np.all(self.data.shape==other.data.shape)
+                assert np.all(self.shape==other.shape)
             except:
-                raise AssertionError('In Band gt: size mismatch')
+                raise AssertionError('In Band {:s}: size mismatch'.format(name))
             else:
-                _data = self.data>other.data
-                _data = _data.astype(float)
-                _data[np.isnan(self.data)] = np.nan
-                return(
-                    Band(
-                        data=_data,
-                        geotransform=self.geotransform,
-                        projection=self.projection
-                    )
-                )
+                ufunc(self.data, other._values(), out=self.data)
         else:
-            raise NotImplementedError('In Band gt: other datatype not implemented')
+            raise NotImplementedError('In Band {:s}: other datatype not implemented'.format(name))
 
-    def __ge__(self, other):
+        return(self)
+
+    def __iadd__(self, other):
         '''
-        Return a binary band which is true if the values are greater
-        than the other and false if otherwise.
+        Add another band data or value to the current band data in place.
         '''
-        if isinstance(other, (int, float)):
-            _data = self.data>=float(other)
-            _data = _data.astype(float)
-            _data[np.isnan(self.data)] = np.nan
-            return(
-                Band(
-                    data=_data,
-                    geotransform=self.geotransform,
-                    projection=self.projection
-                )
-            )
+        return(self._inplace(np.add, other, 'iadd'))
+
+    def __isub__(self, other):
+        '''
+        Subtract another band data or value from the current band data in place.
+        '''
+        return(self._inplace(np.subtract, other, 'isub'))
+
+    def __imul__(self, other):
+        '''
+        Multiply another band data or value to the current band data in place.
+        '''
+        return(self._inplace(np.multiply, other, 'imul'))
+
+    def __itruediv__(self, other):
+        '''
+        Divide the current band data by another band data or value in place.
+        '''
+        return(self._inplace(np.true_divide, other, 'idiv'))
+
+    def _logical(self, ufunc, other, name, out=None):
+        '''
+        Return a logical band with the result of ufunc, i.e. a comparison or a
+        logical operation, between the band data and other. The values are 1
+        for true, 0 for false and np.nan where the band data is np.nan. The
+        result is a MaskBand, or a Band with the data in out if given.
+
+        argument:
+            ufunc: numpy ufunc
+                ufunc with two arguments returning boolean
+            other: Band, float like or None
+                other operand, None for a ufunc with one argument
+            name: string
+                name of the operation for the error message
+            out: array like
+                preallocated floating point output array, default None
+        '''
+        values = self._values()
+
+        if other is None:
+            operands = (values, )
+        elif isinstance(other, Scalar):
+            operands = (values, float(other))
         elif isinstance(other, Band):
             try:
-                assert np.all(self.data.shape==other.data.shape)
+                assert np.all(self.shape==other.shape)
             except:
-                raise AssertionError('In Band ge: size mismatch')
+                raise AssertionError('In Band {:s}: size mismatch'.format(name))
             else:
-                _data = self.data>=other.data
-                _data = _data.astype(float)
-                _data[np.isnan(self.data)] = np.nan
-                return(
-                    Band(
-                        data=_data,
-                        geotransform=self.geotransform,
-                        projection=self.projection
-                    )
-                )
+                operands = (values, other._values())
         else:
-            raise NotImplementedError('In Band ge: other datatype not implemented')
+            raise NotImplementedError('In Band {:s}: other datatype not implemented'.format(name))
 
-    def __lt__(self, other):
-        '''
-        Return a binary band which is true if the values are greater
-        than the other and false if otherwise.
-        '''
-        if isinstance(other, (int, float)):
-            _data = self.data<float(other)
-            _data = _data.astype(float)
-            _data[np.isnan(self.data)] = np.nan
+        inan = np.isnan(values)
+
+        if out is None:
+            # boolean result with the validity, see MaskBand
+            out = ufunc(*operands)
+            valid = np.logical_not(inan, out=inan)
+            out &= valid
             return(
-                Band(
-                    data=_data,
+                MaskBand(
+                    data=out,
+                    valid=valid,
                     geotransform=self.geotransform,
                     projection=self.projection
                 )
             )
-        elif isinstance(other, Band):
-            try:
-                assert np.all(self.data.shape==other.data.shape)
-            except:
-                raise AssertionError('In Band lt: size mismatch')
-            else:
-                _data = self.data<other.data
-                _data = _data.astype(float)
-                _data[np.isnan(self.data)] = np.nan
-                return(
-                    Band(
-                        data=_data,
-                        geotransform=self.geotransform,
-                        projection=self.projection
-                    )
-                )
-        else:
-            raise NotImplementedError('In Band lt: other datatype not implemented')
+
+        if isinstance(out, MaskBand):
+            # the data of a mask band is read-only, the result replaces it
+            result = self._logical(ufunc, other, name)
+            out.values, out.valid = result.values, result.valid
+            out.invalidate()
+            return(out)
+        elif isinstance(out, Band):
+            out.invalidate()
+            out = out.data
+
+        ufunc(*operands, out=out)
+        np.copyto(out, np.nan, where=inan)
+
+        return(
+            Band(
+                data=out,
+                geotransform=self.geotransform,
+                projection=self.projection
+            )
+        )
+
+    def gt(self, other, out=None):
+        '''
+        Return a modified logical band which is true if the values are greater
+        than the other and false if otherwise. The result is written in out if
+        given.
+        '''
+        if isinstance(other, Expression):
+            return(self.lazy().__gt__(other))
+        return(self._logical(np.greater, other, 'gt', out=out))
+
+    def ge(self, other, out=None):
+        '''
+        Return a binary band which is true if the values are greater or equal
+        than the other and false if otherwise. The result is written in out if
+        given.
+        '''
+        if isinstance(other, Expression):
+            return(self.lazy().__ge__(other))
+        return(self._logical(np.greater_equal, other, 'ge', out=out))
+
+    def lt(self, other, out=None):
+        '''
+        Return a binary band which is true if the values are lower than the
+        other and false if otherwise. The result is written in out if given.
+        '''
+        if isinstance(other, Expression):
+            return(self.lazy().__lt__(other))
+        return(self._logical(np.less, other, 'lt', out=out))
+
+    def le(self, other, out=None):
+        '''
+        Return a binary band which is true if the values are lower or equal
+        than the other and false if otherwise. The result is written in out if
+        given.
+        '''
+        if isinstance(other, Expression):
+            return(self.lazy().__le__(other))
+        return(self._logical(np.less_equal, other, 'le', out=out))
+
+    def __gt__(self, other):
+        '''
+        Return a modified logical band which is true if the values are greater
+        than the other and false if otherwise.
+        '''
+        return(self.gt(other))
+
+    def __ge__(self, other):
+        '''
+        Return a binary band which is true if the values are greater
+        than the other and false if otherwise.
+        '''
+        return(self.ge(other))
+
+    def __lt__(self, other):
+        '''
+        Return a binary band which is true if the values are greater
+        than the other and false if otherwise.
+        '''
+        return(self.lt(other))
 
     def __le__(self, other):
         '''
         Return a modified logical band which is true if the values are greater
         than the other and false if otherwise.
         '''
-        if isinstance(other, (int, float)):
-            data = self.data<=float(other)
-            data[np.isnan(self.data)] = np.nan
-            return(
-                Band(
-                    data=data,
-                    geotransform=self.geotransform,
-                    projection=self.projection
-                )
-            )
-        elif isinstance(other, Band):
-            try:
-                assert np.all(self.data.shape==other.data.shape)
-            except:
-                raise AssertionError('In Band le: size mismatch')
-            else:
-                data = self.data<=other.data
-                data[np.isnan(self.data)] = np.nan
-                return(
-                    Band(
-                        data=data,
-                        geotransform=self.geotransform,
-                        projection=self.projection
-                    )
-                )
-        else:
-            raise NotImplementedError('In Band le: other datatype not implemented')
+        return(self.le(other))
 
-    def logical_and(self, other):
+    def logical_and(self, other, out=None):
         '''
         Logical and connection of two Band data
         '''
-        if isinstance(other, Band):
-            _data = np.logical_and(self.data, other.data)
-            _data = _data.astype(float)
-            _data[np.isnan(self.data)] = np.nan
-            return(
-                Band(
-                    data=_data,
-                    geotransform=self.geotransform,
-                    projection=self.projection
-                )
-            )
-        else:
+        if isinstance(other, Expression):
+            return(self.lazy().logical_and(other))
+        elif not isinstance(other, Band):
             raise NotImplementedError('In Band logical_and: only Band data in implemented')
+        return(self._logical(np.logical_and, other, 'logical_and', out=out))
 
-    def logical_or(self, other):
+    def logical_or(self, other, out=None):
         '''
         Logical or of two Band data
         '''
-        if isinstance(other, Band):
-            _data = np.logical_or(self.data, other.data)
-            _data = _data.astype(float)
-            _data[np.isnan(self.data)] = np.nan
-            return(
-                Band(
-                    data=_data,
-                    geotransform=self.geotransform,
-                    projection=self.projection
-                )
-            )
-        else:
+        if isinstance(other, Expression):
+            return(self.lazy().logical_or(other))
+        elif not isinstance(other, Band):
             raise NotImplementedError('In Band logical_or: only Band data is implemented')
-    
-    def logical_not(self):
+        return(self._logical(np.logical_or, other, 'logical_or', out=out))
+
+    def logical_not(self, out=None):
         '''
         Logical not of a Band
         '''
-        _data = np.logical_not(self.data)
-        _data = _data.astype(float)
-        _data[np.isnan(self.data)] = np.nan
-        return(
-            Band(
-                data=_data,
-                geotransform=self.geotransform,
-                projection=self.projection
-            )
-        )
+        return(self._logical(np.logical_not, None, 'logical_not', out=out))
 
     def nan_avg(self, other):
         '''
         Do a nan average with other.
         '''
         if isinstance(other, Band):
-            _data = np.empty((self.data.shape[0], self.data.shape[1], 2), dtype=float)
+            _data = np.empty((self.data.shape[0], self.data.shape[1], 2), dtype=float_dtype(self.data))
             _data[:, :, 0] = self.data
             _data[:, :, 1] = other.data
             
@@ -746,7 +2278,7 @@ class Band(object):
         Do a nan sum with other.
         '''
         if isinstance(other, Band):
-            _data = np.empty((self.data.shape[0], self.data.shape[1], 2), dtype=float)
+            _data = np.empty((self.data.shape[0], self.data.shape[1], 2), dtype=float_dtype(self.data))
             _data[:, :, 0] = self.data
             _data[:, :, 1] = other.data
             
@@ -764,7 +2296,7 @@ class Band(object):
         else:
             raise NotImplementedError('In Band nan_avg: only Band data is implemented')
 
-    def to_geotiff(self, fname, dtype=gdal.GDT_Float32, epsg='auto'):
+    def to_geotiff(self, fname, dtype=gdal.GDT_Float32, epsg='auto', cog=False, overviews=None, nodata='auto', **kwargs):
         '''
         Save band data to geotiff to location passed by `to` with datatype
         defined by `dtype`
@@ -773,23 +2305,44 @@ class Band(object):
             fname: string
                 The filename to be saved
             dtype: gdal data type
-                Gdal datatype to be used for saving, default `gdal.GDT_Float32`
+                Gdal datatype to be used for saving, default `gdal.GDT_Float32`.
+                `auto` scans the data and uses `gdal.GDT_Byte` for binary data
+                and `gdal.GDT_Float32` otherwise (MaskBand is always saved as
+                `gdal.GDT_Byte` by default).
             epsg: epsg code
                 epsg code to reproject the data. `auto` saves the data to
                 original projection. Default `auto`
+            cog: boolean
+                save as Cloud Optimized GeoTiff with internal overviews
+            overviews: list of int
+                overview levels added to a regular GeoTiff, e.g. [2, 4, 8]
+            nodata: float like, None or 'auto'
+                no data value replacing nan, default `auto` uses the maximum
+                value of integer datatypes if the data has nan, see
+                `geotiff_nodata`. Only used with epsg `auto`.
+            kwargs:
+                creation options, see `geotiff_options`, default is tiled and
+                DEFLATE compressed with floating point predictor
 
         '''
         fname = Path(fname).as_posix()
         row, col = self.data.shape
         
         if epsg=='auto':
-            driver = gdal.GetDriverByName('GTiff')
-            gtiff = driver.Create(fname, col, row, 1, dtype)
-            gtiff.GetRasterBand(1).WriteArray(self.data)
-            gtiff.SetGeoTransform(self.geotransform)
-            gtiff.SetProjection(self.projection)
-            gtiff.FlushCache()
-            gtiff = None
+            if dtype == 'auto':
+                dtype = compact_dtype(self.data)
+
+            write_geotiff(
+                fname=fname,
+                arrays=[self.data],
+                geotransform=self.geotransform,
+                projection=self.projection,
+                dtype=dtype,
+                nodata=nodata,
+                cog=cog,
+                overviews=overviews,
+                **kwargs
+            )
         else:
             try:
                 in_proj = osr.SpatialReference()
@@ -799,6 +2352,10 @@ class Band(object):
             except:
                 raise Exception('Problem with EPSG code!')
             else:
+                if dtype == 'auto':
+                    # bilinear reprojection does not keep binary values
+                    dtype = gdal.GDT_Float32
+
                 mdriver = gdal.GetDriverByName('MEM')
                 fdriver = gdal.GetDriverByName('GTiff')
                 src = mdriver.Create('Memory', row, col, 1, dtype)
@@ -829,7 +2386,7 @@ class Band(object):
                 ysize = int(np.abs((uly-lry)//pixely))
                 geotransform = (ulx, pixelx, self.geotransform[2], uly, self.geotransform[4], pixely)
 
-                gtiff = fdriver.Create(fname, xsize, ysize, 1, dtype)
+                gtiff = fdriver.Create(fname, xsize, ysize, 1, dtype, options=geotiff_options(dtype=dtype, **kwargs))
                 gtiff.SetGeoTransform(geotransform)
                 gtiff.SetProjection(out_proj.ExportToWkt())
                 gdal.ReprojectImage(
@@ -844,80 +2401,174 @@ class Band(object):
                 src = None
                 del gtiff, src
 
-    def to_netcdf(self, fname, epsg=4326):
+    def to_netcdf(
+        self,
+        fname,
+        epsg=4326,
+        varname='value',
+        long_name='Pixel value',
+        time=None,
+        lonlat=False,
+        dtype='f4',
+        complevel=4,
+        chunksizes=None,
+        mode='w'):
         '''
         Save band data to netCDF4 file to location passed by `to`.
 
+        The grid is defined by the 1-D x and y pixel center coordinates in the
+        band projection, referenced by a CF grid_mapping variable `crs`. The
+        variables are chunked and compressed with zlib and shuffle.
+
         argument:
             fname: string
                 filename to be used
             epsg: epsg code
-                epsg code to reproject the data
-        '''
-        row, col = self.data.shape
+                epsg code of the 2-D lon lat coordinates, if lonlat
+            varname: string
+                name of the variable, default `value`
+            long_name: string
+                long name of the variable
+            time: datetime like
+                time of the band. If given, the variable has an unlimited time
+                dimension, and the band is written at the matching time step
+                or appended as a new time step.
+            lonlat: boolean
+                compute and save 2-D lon, lat coordinates, default False
+            dtype: string or numpy dtype
+                storage dtype of the variable, default `f4`
+            complevel: int
+                zlib compression level, 0 for no compression
+            chunksizes: tuple
+                (row, col) chunk size, default None uses up to 512x512
+            mode: string
+                `w` creates a new file, `a` adds the variable to an existing
+                file with the same grid, e.g., to write multiple bands or time
+                steps one at a time
+        '''
+        row, col = self.shape
+        fname = Path(fname)
+
+        # Pixel center coordinates
+        x = self.geotransform[0] + (np.arange(col)+0.5)*self.geotransform[1]
+        y = self.geotransform[3] + (np.arange(row)+0.5)*self.geotransform[5]
+
+        if chunksizes is None:
+            chunksizes = (min(512, row), min(512, col))
 
-        # Setting up coordinate transformation
-        try:
-            in_proj = osr.SpatialReference()
-            in_proj.ImportFromWkt(self.projection)
-            out_proj = osr.SpatialReference()
-            out_proj.ImportFromEPSG(epsg)
-        except:
-            raise Exception('Problem with EPSG code!')
-        else:
-            trans_coord = osr.CoordinateTransformation(in_proj, out_proj)
-            x = np.array([self.geotransform[0]+i*self.geotransform[1] for i in np.arange(row)])
-            y = np.array([self.geotransform[3]+i*self.geotransform[5] for i in np.arange(col)])
-
-            meshx, meshy = np.meshgrid(x, y)
-            meshxy = zip(meshx.flatten(), meshy.flatten())
-            lonlat = np.array([trans_coord.TransformPoint(xy[0], xy[1])[0:2] for xy in meshxy])
-            lon = np.reshape(lonlat[:, 0], meshx.shape)
-            lat = np.reshape(lonlat[:, 1], meshx.shape)
-            del lonlat, meshxy, meshx, meshy
-            
         try:
-            nc = Dataset(
-                filename=fname, 
-                mode='w', 
-                clobber=True,
-                format='NETCDF4_CLASSIC'
-            )
+            if mode == 'a' and fname.exists():
+                nc = Dataset(filename=fname, mode='a')
+            else:
+                nc = Dataset(
+                    filename=fname, 
+                    mode='w', 
+                    clobber=True,
+                    format='NETCDF4_CLASSIC'
+                )
         except:
             raise Exception('netCDF Error!')
-        else:
-            # Dimensitons
-            dx = nc.createDimension(dimname='x', size=len(x))
-            dy = nc.createDimension(dimname='y', size=len(y))
-
-            # Variables
-            vx = nc.createVariable(varname='x', datatype=float, dimensions=(dx))
-            vx.long_name = 'x coordinate'
-            vx.wkt = self.projection
-            vx[:] = x
-
-            vy = nc.createVariable(varname='y', datatype=float, dimensions=(dy))
-            vy.long_name = 'y coordinate'
-            vy.wkt = self.projection
-            vy[:] = y
-
-            lon = nc.createVariable(varname='lon', datatype=float, dimensions=(dx, dy))
-            lon.long_name = 'Longitude'
-            lon.units = 'degrees_east'
-            lon[:] = lon
-
-            lat = nc.createVariable(varname='lat', datatype=float, dimensions=(dx, dy))
-            lat.long_name = 'Latitude'
-            lat.units = 'degrees_north'
-            lat[:] = lat
-
-            value = nc.createVariable(varname='value', datatype=float, dimensions=(dx, dy))
-            value.long_name = 'Pixel value'
-            value[:] = self.data
+
+        try:
+            if 'x' not in nc.dimensions:
+                self._netcdf_grid(nc, x, y, chunksizes, complevel, epsg if lonlat else None)
+            elif len(nc.dimensions['x']) != col or len(nc.dimensions['y']) != row:
+                raise AssertionError('In Band to_netcdf: size mismatch with {:s}'.format(fname.as_posix()))
+
+            dimensions = ('y', 'x')
+            index = ()
+            if time is not None:
+                if 'time' not in nc.dimensions:
+                    nc.createDimension(dimname='time', size=None)
+                    vtime = nc.createVariable(varname='time', datatype='f8', dimensions=('time', ))
+                    vtime.long_name = 'time'
+                    vtime.units = 'seconds since 1970-01-01 00:00:00'
+                    vtime.calendar = 'standard'
+                vtime = nc.variables['time']
+                tvalue = date2num(pd.to_datetime(time).to_pydatetime(), units=vtime.units, calendar=vtime.calendar)
+                itime = np.flatnonzero(vtime[:] == tvalue)
+                if len(itime):
+                    itime = int(itime[0])
+                else:
+                    itime = len(vtime)
+                    vtime[itime] = tvalue
+                dimensions = ('time', ) + dimensions
+                index = (itime, )
+
+            if varname not in nc.variables:
+                value = nc.createVariable(
+                    varname=varname,
+                    datatype=dtype,
+                    dimensions=dimensions,
+                    zlib=complevel > 0,
+                    complevel=max(complevel, 1),
+                    shuffle=True,
+                    chunksizes=(1, )*len(index) + tuple(chunksizes),
+                    fill_value=np.nan if np.issubdtype(np.dtype(dtype), np.floating) else None
+                )
+                value.long_name = long_name
+                value.grid_mapping = 'crs'
+                if 'lon' in nc.variables:
+                    value.coordinates = 'lon lat'
+            value = nc.variables[varname]
+
+            if self.loaded:
+                value[index + (slice(None), slice(None))] = self.data
+            else:
+                for window, block in self.iter_blocks():
+                    value[index + (
+                        slice(window.row, window.row+window.nrows),
+                        slice(window.col, window.col+window.ncols)
+                    )] = block.data
         finally:
             nc.sync()
             nc.close()
 
+    def _netcdf_grid(self, nc, x, y, chunksizes, complevel, epsg=None):
+        '''
+        Create the grid of a netCDF file, with 1-D x, y, the grid mapping, and
+        optionally 2-D lon, lat in epsg computed chunk by chunk of rows.
+        '''
+        nc.createDimension(dimname='y', size=len(y))
+        nc.createDimension(dimname='x', size=len(x))
+
+        vx = nc.createVariable(varname='x', datatype='f8', dimensions=('x', ))
+        vx.long_name = 'x coordinate'
+        vx.standard_name = 'projection_x_coordinate'
+        vx[:] = x
+
+        vy = nc.createVariable(varname='y', datatype='f8', dimensions=('y', ))
+        vy.long_name = 'y coordinate'
+        vy.standard_name = 'projection_y_coordinate'
+        vy[:] = y
+
+        crs = nc.createVariable(varname='crs', datatype='i4')
+        crs.crs_wkt = self.projection
+        crs.spatial_ref = self.projection
+        crs.GeoTransform = ' '.join([str(i) for i in self.geotransform])
+
+        if epsg is not None:
+            vlon = nc.createVariable(
+                varname='lon', datatype='f8', dimensions=('y', 'x'),
+                zlib=complevel > 0, complevel=max(complevel, 1), chunksizes=chunksizes
+            )
+            vlon.long_name = 'Longitude'
+            vlon.units = 'degrees_east'
+
+            vlat = nc.createVariable(
+                varname='lat', datatype='f8', dimensions=('y', 'x'),
+                zlib=complevel > 0, complevel=max(complevel, 1), chunksizes=chunksizes
+            )
+            vlat.long_name = 'Latitude'
+            vlat.units = 'degrees_north'
+
+            transformer = get_transformer(self.projection, epsg, always_xy=True)
+            for row in range(0, len(y), chunksizes[0]):
+                meshx, meshy = np.meshgrid(x, y[row:row+chunksizes[0]])
+                lon, lat = transformer.transform(meshx, meshy)
+                vlon[row:row+chunksizes[0], :] = lon
+                vlat[row:row+chunksizes[0], :] = lat
+
     def plot(self, title='Band', cmap='binary', saveto=None):
         '''
         Plotting function with given title, cmap
@@ -940,10 +2591,704 @@ class Band(object):
             plt.savefig(saveto, dpi=300)
             plt.close()
 
+class MaskBand(Band):
+    def __init__(self, data=None, geotransform=None, projection=None, valid=None, **kwargs):
+        '''
+        Binary band, e.g., a water mask or a thresholded image, stored as a
+        boolean array of values with a separate boolean validity array, instead
+        of 1, 0 and np.nan in a floating point array. Returned by the
+        comparison and logical operators of Band.
+
+        `data` is available as a floating point array of 1, 0 and np.nan for
+        compatibility with Band. It is computed on first access and cached,
+        and it is read-only: writing to it raises a ValueError instead of
+        silently changing a copy. Set `data`, or change `values` and `valid`
+        and call invalidate(), to modify the band. The in-place arithmetic
+        operators return a floating point Band, as the binary operators.
+
+        arguments:
+            data: array like
+                2D boolean array, or array of 1, 0 and np.nan
+            geotransform: string
+                geotransform information, default None
+            projection: string
+                projection information, default None
+            valid: array like
+                2D boolean array, False for the missing values. Default None
+                uses the np.nan values of data.
+
+        returns:
+            Mask band: MaskBand
+        '''
+        self.values = None
+        self.valid = None
+        self._data = None
+        super().__init__(data=data, geotransform=geotransform, projection=projection, **kwargs)
+
+        if valid is not None and self.values is not None:
+            self.valid = np.asarray(valid, dtype=bool)
+            self.values = np.logical_and(self.values, self.valid)
+            self.invalidate()
+
+    @property
+    def data(self):
+        '''
+        Band data as read-only floating point array of 1, 0 and np.nan, cached
+        until the band is modified
+        '''
+        if self.values is None:
+            return(None)
+
+        if self._data is None:
+            data = self.values.astype(_dtype)
+            np.copyto(data, np.nan, where=np.logical_not(self.valid))
+            data.setflags(write=False)
+            self._data = data
+        return(self._data)
+
+    @data.setter
+    def data(self, data):
+        self._stats = None
+        self._data = None
+        if data is None:
+            self.values = None
+            self.valid = None
+            return
+
+        data = np.asarray(data)
+        if np.issubdtype(data.dtype, np.floating):
+            self.valid = np.logical_not(np.isnan(data))
+        else:
+            self.valid = np.ones(shape=data.shape, dtype=bool)
+
+        if np.issubdtype(data.dtype, np.bool_):
+            self.values = data
+        else:
+            self.values = np.logical_and(data != 0, self.valid)
+
+    @property
+    def loaded(self):
+        '''
+        True if the band data is in memory
+        '''
+        return(self.values is not None)
+
+    def invalidate(self):
+        '''
+        Clear the cached statistics and floating point data, needed after
+        changing values or valid directly
+        '''
+        self._stats = None
+        self._data = None
+
+    @property
+    def shape(self):
+        '''
+        Shape of the band data
+        '''
+        if self.values is not None:
+            return(self.values.shape)
+        else:
+            return(super().shape)
+
+    @property
+    def dtype(self):
+        '''
+        dtype of the band data, i.e., the working dtype
+        '''
+        return(_dtype)
+
+    def _values(self):
+        '''
+        Data to be used in the operations with other Band
+        '''
+        return(self.data)
+
+    def _block(self, window):
+        '''
+        MaskBand of a window, the values and validity are views.
+        '''
+        rows = slice(window.row, window.row+window.nrows)
+        cols = slice(window.col, window.col+window.ncols)
+        block = MaskBand(
+            geotransform=block_geotransform(self.geotransform, window),
+            projection=self.projection,
+            window=window
+        )
+        block.values = self.values[rows, cols]
+        block.valid = self.valid[rows, cols]
+        return(block)
+
+    @staticmethod
+    def _truth(other):
+        '''
+        Truth value of the other operand of a logical operation, np.nan is true
+        '''
+        if isinstance(other, MaskBand):
+            return(np.logical_or(other.values, np.logical_not(other.valid)))
+        else:
+            return(other._values().astype(bool))
+
+    def set_missing(self, value, to=np.nan):
+        '''
+        set the missing value in data from value 
+
+        argument:
+            value: float like
+                Value to be replaced, 1, 0 or np.nan
+            to: float like
+                Values replaced by to, 1, 0 or np.nan
+        '''
+        if np.isnan(value) and to in (0, 1):
+            np.copyto(self.values, bool(to), where=np.logical_not(self.valid))
+            self.valid[:] = True
+        elif value in (0, 1) and np.isnan(to):
+            self.valid &= self.values != bool(value)
+            self.values &= self.valid
+        elif not (np.isnan(value) and np.isnan(to)):
+            raise NotImplementedError('In MaskBand set_missing: only 1, 0 and np.nan are implemented')
+        self.invalidate()
+
+    def upscale(self, factor, method='nearest'):
+        '''
+        increase the resolution with an integer factor by repeating the
+        pixels, see Band.upscale. Only nearest is available for a mask band.
+        '''
+        if method!='nearest' or not float(factor).is_integer():
+            raise NotImplementedError('In MaskBand upscale: only nearest with an integer factor, use astype() for the other')
+
+        factor = int(factor)
+        nrows, ncols = self.shape
+        values = np.empty(shape=(nrows*factor, ncols*factor), dtype=bool)
+        values.reshape(nrows, factor, ncols, factor)[...] = self.values[:, None, :, None]
+        valid = np.empty(shape=(nrows*factor, ncols*factor), dtype=bool)
+        valid.reshape(nrows, factor, ncols, factor)[...] = self.valid[:, None, :, None]
+
+        if self.geotransform is not None:
+            self.geotransform = scaled_geotransform(self.geotransform, (nrows, ncols), values.shape)
+        self.values = values
+        self.valid = valid
+        self.invalidate()
+        return(True)
+
+    def _inplace(self, ufunc, other, name):
+        '''
+        The arithmetic is not done in place on a mask band, python falls back
+        to the binary operator, which returns a floating point Band.
+        '''
+        return(NotImplemented)
+
+    def normalize(self, *args, **kwargs):
+        '''
+        A mask band can not be normalized, use astype() to get a floating point
+        Band.
+        '''
+        raise NotImplementedError('In MaskBand normalize: use astype() to get a floating point Band')
+
+    def mask(self, by, inverse=False, inplace=False):
+        '''
+        Apply a mask 'by' on the mask band - keeping the values presented by 1
+        in mask 'by'. Set inverse to True for inversing masking. The masked
+        values become invalid, i.e., np.nan.
+
+        argument:
+            by: Band
+                Mask band
+            inverse: boolean
+                Inverse masking
+            inplace: boolean
+                mask the band in place and return the band itself, instead of a
+                masked copy
+        '''
+        if not isinstance(by, Band):
+            raise NotImplementedError('In mask: mask must be a Band type')
+
+        if inverse:
+            remove = self._truth(by)
+        elif isinstance(by, MaskBand):
+            remove = np.logical_not(by.values)
+        else:
+            remove = np.logical_not(np.nan_to_num(by._values(), nan=0).astype(bool))
+
+        if inplace:
+            band = self
+        else:
+            band = MaskBand(
+                data=self.values.copy(),
+                valid=self.valid.copy(),
+                geotransform=self.geotransform,
+                projection=self.projection
+            )
+
+        band.valid &= np.logical_not(remove)
+        band.values &= band.valid
+        band.invalidate()
+        return(band)
+
+    def _logical(self, ufunc, other, name, out=None):
+        '''
+        Logical operations are done on the boolean values, the comparisons and
+        the output in out use the Band implementation.
+        '''
+        if ufunc not in (np.logical_and, np.logical_or, np.logical_not) or out is not None:
+            return(super()._logical(ufunc, other, name, out=out))
+
+        if other is None:
+            values = ufunc(self.values)
+        else:
+            try:
+                assert np.all(self.shape==other.shape)
+            except:
+                raise AssertionError('In Band {:s}: size mismatch'.format(name))
+            values = ufunc(self.values, self._truth(other))
+
+        valid = self.valid.copy()
+        values &= valid
+        return(
+            MaskBand(
+                data=values,
+                valid=valid,
+                geotransform=self.geotransform,
+                projection=self.projection
+            )
+        )
+
+    def clean(self, npixel, fillvalue, background=False, connectivity=1):
+        '''
+        Clean the image below given pixel blob size (number of pixels) grouped
+        together, see Band.clean. The result is a MaskBand for fillvalue 0 or 1.
+        '''
+        if fillvalue not in (0, 1):
+            return(self.astype().clean(
+                npixel=npixel, fillvalue=fillvalue, background=background, connectivity=connectivity))
+
+        invalid = np.logical_not(self.valid)
+        if background:
+            values = np.zeros(shape=self.shape, dtype=bool)
+            labeled = np.logical_or(self.values, invalid)
+        else:
+            values = np.ones(shape=self.shape, dtype=bool)
+            # same as the blobs of nanmax(data)-data
+            labeled = np.logical_not(self.values) if np.any(self.values) else invalid
+
+        retained = retained_blobs(labeled, npixel=npixel, connectivity=connectivity)
+        np.copyto(values, bool(fillvalue), where=retained)
+        values &= self.valid
+
+        return(
+            MaskBand(
+                data=values,
+                valid=self.valid.copy(),
+                geotransform=self.geotransform,
+                projection=self.projection
+            )
+        )
+
+    def convolute(
+        self, 
+        kernel=[[0, -1, 0], [-1, 4, -1], [0, -1, 0]], 
+        replacenan=False, 
+        replacevalue=np.nan, 
+        fillvalue=0, 
+        nanmask=True,
+        cleanedge=True,
+        method='auto',
+        nthreads=1):
+        '''
+        Convolute the mask with the given kernel, see Band.convolute. The
+        convolution is done on the boolean values by shift_convolve with a
+        small integer dtype for integer kernels and fillvalue. With nanmask,
+        the result is a MaskBand.
+        '''
+        kernel = np.array(kernel)
+        if replacenan:
+            return(self.astype().convolute(
+                kernel=kernel, replacenan=replacenan, replacevalue=replacevalue, fillvalue=fillvalue,
+                nanmask=nanmask, cleanedge=cleanedge, method=method, nthreads=nthreads))
+
+        bound = np.abs(kernel).sum()*max(1, abs(fillvalue))
+        if np.issubdtype(kernel.dtype, np.integer) and float(fillvalue).is_integer() and bound < 2**15:
+            dtype = np.int8 if bound < 2**7 else np.int16
+            values = self.values
+        else:
+            dtype = _dtype
+            values = self.values.astype(dtype)
+
+        conv = convolve(values, kernel, fillvalue=fillvalue, method=method, nthreads=nthreads, dtype=dtype)
+
+        # nan in the data spreads over the footprint of the kernel
+        invalid = nan_footprint(np.logical_not(self.valid), kernel.shape)
+
+        if nanmask:
+            values = conv >= 1
+            values &= np.logical_not(invalid)
+            if cleanedge:
+                values[:, 0:2] = False
+                values[:, -2:] = False
+                values[0:2, :] = False
+                values[-2:, :] = False
+            return(
+                MaskBand(
+                    data=values,
+                    valid=values.copy(),
+                    geotransform=self.geotransform,
+                    projection=self.projection
+                )
+            )
+        else:
+            conv = conv.astype(_dtype)
+            np.copyto(conv, np.nan, where=invalid)
+            if cleanedge:
+                conv[:, 0:2] = np.nan
+                conv[:, -2:] = np.nan
+                conv[0:2, :] = np.nan
+                conv[-2:, :] = np.nan
+            return(
+                Band(
+                    data=conv,
+                    geotransform=self.geotransform,
+                    projection=self.projection
+                )
+            )
+
+    def to_geotiff(self, fname, dtype='auto', epsg='auto', cog=False, overviews=None, nodata='auto', **kwargs):
+        '''
+        Save the mask to geotiff, see Band.to_geotiff. With dtype `auto` the
+        mask is saved as `gdal.GDT_Byte` without converting to floating point,
+        the invalid pixels are saved as no data 255 (`auto`) or nodata.
+        '''
+        if epsg=='auto' and dtype in ('auto', gdal.GDT_Byte):
+            data = self.values.astype(np.uint8)
+            if isinstance(nodata, str) and nodata == 'auto':
+                nodata = None if self.valid.all() else gdal_nodata(gdal.GDT_Byte)
+            if nodata is not None:
+                np.copyto(data, nodata, where=np.logical_not(self.valid))
+            write_geotiff(
+                fname=fname,
+                arrays=[data],
+                geotransform=self.geotransform,
+                projection=self.projection,
+                dtype=gdal.GDT_Byte,
+                nodata=nodata,
+                cog=cog,
+                overviews=overviews,
+                **kwargs
+            )
+        else:
+            super().to_geotiff(fname, dtype=dtype, epsg=epsg, cog=cog, overviews=overviews, nodata=nodata, **kwargs)
+
+    def pack(self):
+        '''
+        Bit-packed representation of the mask for storage, 1 bit per pixel for
+        the values and for the validity.
+
+        returns:
+            dictionary of packed values, valid and the shape
+        '''
+        return({
+            'values':np.packbits(self.values),
+            'valid':np.packbits(self.valid),
+            'shape':self.shape
+        })
+
+    @staticmethod
+    def unpack(packed, geotransform=None, projection=None):
+        '''
+        MaskBand from the bit-packed representation given by `pack`
+        '''
+        shape = tuple(packed['shape'])
+        count = int(np.prod(shape))
+        return(
+            MaskBand(
+                data=np.unpackbits(packed['values'], count=count).astype(bool).reshape(shape),
+                valid=np.unpackbits(packed['valid'], count=count).astype(bool).reshape(shape),
+                geotransform=geotransform,
+                projection=projection
+            )
+        )
+
+class Expression(object):
+    arithmetic = {
+        'add':np.add,
+        'sub':np.subtract,
+        'mul':np.multiply,
+        'div':np.true_divide
+    }
+    comparison = {
+        'gt':np.greater,
+        'ge':np.greater_equal,
+        'lt':np.less,
+        'le':np.less_equal
+    }
+    logical = {
+        'and':np.logical_and,
+        'or':np.logical_or
+    }
+    symbols = {
+        'add':'+', 'sub':'-', 'mul':'*', 'div':'/',
+        'gt':'>', 'ge':'>=', 'lt':'<', 'le':'<=',
+        'and':'&', 'or':'|'
+    }
+
+    def __init__(self, op, args, like):
+        '''
+        Lazy expression of Band operations. Created by `Band.lazy()`, and
+        evaluated by `compute()`. The semantic of the operators is the same as
+        for Band, e.g., an expression ending with a comparison or logical
+        operator is computed as a MaskBand, invalid where the left operand is
+        np.nan, or as 1, 0 and np.nan in a Band on the `out` array.
+
+        arguments:
+            op: string
+                operation, 'band' for a leaf
+            args: list
+                operands, Band for a leaf, otherwise Expression or float
+            like: Band or Expression
+                provides the shape, geotransform and projection
+        '''
+        self.op = op
+        self.args = args
+        self.shape = like.shape
+        self.geotransform = like.geotransform
+        self.projection = like.projection
+
+    def _operand(self, other, name):
+        '''
+        Convert other to an operand of the expression tree
+        '''
+        if isinstance(other, Scalar):
+            return(float(other))
+        elif isinstance(other, Band):
+            other = other.lazy()
+        elif not isinstance(other, Expression):
+            raise NotImplementedError('In Expression {:s}: other datatype not implemented'.format(name))
+
+        try:
+            assert np.all(self.shape==other.shape)
+        except:
+            raise AssertionError('In Expression {:s}: size mismatch'.format(name))
+
+        return(other)
+
+    def _binary(self, op, other, reverse=False):
+        other = self._operand(other, op)
+        if reverse:
+            return(Expression(op=op, args=[other, self], like=self))
+        else:
+            return(Expression(op=op, args=[self, other], like=self))
+
+    def __add__(self, other):
+        return(self._binary('add', other))
+
+    def __radd__(self, other):
+        return(self._binary('add', other, reverse=True))
+
+    def __sub__(self, other):
+        return(self._binary('sub', other))
+
+    def __rsub__(self, other):
+        return(self._binary('sub', other, reverse=True))
+
+    def __mul__(self, other):
+        return(self._binary('mul', other))
+
+    def __rmul__(self, other):
+        return(self._binary('mul', other, reverse=True))
+
+    def __truediv__(self, other):
+        return(self._binary('div', other))
+
+    def __rtruediv__(self, other):
+        return(self._binary('div', other, reverse=True))
+
+    def __neg__(self):
+        return(self._binary('mul', -1.0))
+
+    def __gt__(self, other):
+        return(self._binary('gt', other))
+
+    def __ge__(self, other):
+        return(self._binary('ge', other))
+
+    def __lt__(self, other):
+        return(self._binary('lt', other))
+
+    def __le__(self, other):
+        return(self._binary('le', other))
+
+    def logical_and(self, other):
+        return(self._binary('and', other))
+
+    def logical_or(self, other):
+        return(self._binary('or', other))
+
+    def logical_not(self):
+        return(Expression(op='not', args=[self], like=self))
+
+    def __repr__(self):
+        '''
+        Print representation of the expression tree
+        '''
+        if self.op == 'band':
+            return('Band({:d} - {:d})'.format(self.shape[0], self.shape[1]))
+        elif self.op == 'not':
+            return('~{}'.format(self.args[0]))
+        else:
+            return('({} {:s} {})'.format(self.args[0], self.symbols[self.op], self.args[1]))
+
+    def _leaf(self, row, nrows):
+        '''
+        Rows of the band of a leaf. Returns the data and if it is a temporary
+        array owned by the evaluation, i.e., can be overwritten.
+        '''
+        band = self.args[0]
+        if isinstance(band, MaskBand):
+            values = band.values[row:row+nrows].astype(_dtype)
+            np.copyto(values, np.nan, where=np.logical_not(band.valid[row:row+nrows]))
+            return(values, True)
+        elif band.loaded:
+            data = band.data[row:row+nrows]
+            if np.issubdtype(data.dtype, np.floating):
+                return(data, False)
+            else:
+                values = data.astype(_dtype)
+                if band.nodata is not None:
+                    values[data == band.nodata] = np.nan
+                return(values, True)
+        else:
+            block = band.read_window(Window(row, 0, nrows, self.shape[1]))
+            return(block._values(), True)
+
+    @staticmethod
+    def _buffer(operands, dtype):
+        '''
+        Select an owned operand array of dtype to be used as output buffer
+        '''
+        for data, owned in operands:
+            if owned and data.dtype == dtype:
+                return(data)
+        return(None)
+
+    def _evaluate(self, row, nrows):
+        '''
+        Evaluate the expression on the given rows. Returns the result and if it
+        is a temporary array owned by the evaluation.
+        '''
+        if self.op == 'band':
+            return(self._leaf(row, nrows))
+
+        operands = [
+            arg._evaluate(row, nrows) if isinstance(arg, Expression) else (arg, False)
+            for arg in self.args
+        ]
+        left = operands[0][0]
+
+        if self.op in self.arithmetic:
+            right = operands[1][0]
+            dtype = np.result_type(left, right)
+            out = self._buffer(operands, dtype)
+            out = self.arithmetic[self.op](left, right, out=out)
+        else:
+            inan = np.isnan(left)
+            out = self._buffer(operands[0:1], float_dtype(left))
+            if out is None:
+                out = np.empty(left.shape, dtype=float_dtype(left))
+
+            if self.op in self.comparison:
+                self.comparison[self.op](left, operands[1][0], out=out)
+            elif self.op in self.logical:
+                self.logical[self.op](left, operands[1][0], out=out)
+            elif self.op == 'not':
+                np.logical_not(left, out=out)
+            else:
+                raise NotImplementedError('In Expression: operation {:s} not implemented'.format(self.op))
+
+            out[inan] = np.nan
+
+        return(out, True)
+
+    def compute(self, chunksize=None, out=None):
+        '''
+        Evaluate the expression chunk by chunk of rows, allocating only chunk
+        sized temporary arrays.
+
+        arguments:
+            chunksize: int
+                number of rows per chunk, default None uses about 1 million
+                pixels per chunk
+            out: array like
+                preallocated output array, default None
+
+        returns:
+            Band, or MaskBand for a comparison or logical expression without
+            out, as the Band operators
+        '''
+        nrow, ncol = self.shape
+        boolean = out is None and self.op not in self.arithmetic and self.op != 'band'
+        if chunksize is None:
+            chunksize = max(1, 2**20//ncol)
+
+        for row in range(0, nrow, chunksize):
+            nrows = min(chunksize, nrow-row)
+            data, _ = self._evaluate(row, nrows)
+            if out is None:
+                out = np.empty(shape=self.shape, dtype=data.dtype)
+            out[row:row+nrows] = data
+
+        if boolean:
+            return(
+                MaskBand(
+                    data=out,
+                    geotransform=self.geotransform,
+                    projection=self.projection
+                )
+            )
+
+        return(
+            Band(
+                data=out,
+                geotransform=self.geotransform,
+                projection=self.projection
+            )
+        )
+
+def hsv_bands(red, green, blue, channels='hsv', nthreads=1):
+    '''
+    Hue, saturation and value bands computed directly from the red, green and
+    blue bands, see rgb_to_hsv. Only the requested channels are allocated, the
+    rgb cube is not built.
+
+    arguments:
+        red, green, blue: Band
+            bands of equal size, values in 0 to 1
+        channels: string
+            channels to compute, any of 'h', 's' and 'v' in the order of the
+            returned bands. Default 'hsv'.
+        nthreads: int
+            number of threads, default 1
+
+    returns:
+        tuple of Band, one for each channel
+    '''
+    hsv = rgb_to_hsv(
+        red=red._values(),
+        green=green._values(),
+        blue=blue._values(),
+        channels=channels,
+        nthreads=nthreads
+    )
+    return(
+        tuple(
+            Band(data=data, geotransform=red.geotransform, projection=red.projection)
+            for data in hsv
+        )
+    )
+
 class RGB(object):
     def __init__(self, red, green, blue):
         '''
-        RGB band using band using in the red-green-blue band.
+        RGB band using band using in the red-green-blue band. The bands are
+        kept by reference, the rgb cube is only built when needed, see `rgb`.
 
         argument:
             red: Band
@@ -968,8 +3313,8 @@ class RGB(object):
             # Shape checking
             assert np.all(
                 [
-                    np.all(red.data.shape == green.data.shape),
-                    np.all(green.data.shape == blue.data.shape)
+                    np.all(red.shape == green.shape),
+                    np.all(green.shape == blue.shape)
                 ]
             )
         except:
@@ -979,12 +3324,21 @@ class RGB(object):
             self.geotransform = red.geotransform
             self.projection = red.projection
 
-            # Build the RGB
-            row, col = red.data.shape[0:2]
-            self.rgb = np.empty(shape=[row, col, 3])
-            self.rgb[:, :, 0] = red.data
-            self.rgb[:, :, 1] = green.data
-            self.rgb[:, :, 2] = blue.data
+            self.red = red
+            self.green = green
+            self.blue = blue
+
+    @property
+    def rgb(self):
+        '''
+        rgb cube of shape (row, col, 3), built from the bands on each access
+        '''
+        row, col = self.red.shape[0:2]
+        rgb = np.empty(shape=[row, col, 3])
+        rgb[:, :, 0] = self.red._values()
+        rgb[:, :, 1] = self.green._values()
+        rgb[:, :, 2] = self.blue._values()
+        return(rgb)
 
     @staticmethod
     def rgb2hsv(r, g, b):
@@ -1027,7 +3381,7 @@ class RGB(object):
 
         return(h, s, v)
 
-    def to_hsv(self, method='matplotlib'):
+    def to_hsv(self, method='matplotlib', nthreads=1):
         '''
         Convert the red-green-blue space to hue-saturation-value space and 
         return the individual bands.
@@ -1036,19 +3390,22 @@ class RGB(object):
             method: string
                 method to be used to convert RGB to HSV.
                     `matplotlib` uses the matplotlib routines
-                    `local` uses the local routine
-                default is `matplotlib` and the fastest option
+                    `local` uses the vectorized local routine `rgb_to_hsv`,
+                    which is faster and needs less memory
+                default is `matplotlib`
+            nthreads: int
+                number of threads for the `local` method, default 1
         '''
         if method=='matplotlib':
             # TODO rgb values must be normalized
-            inan = np.where(np.isnan(self.rgb[:, :, 0]))
-            hsv = mcl.rgb_to_hsv(self.rgb)
+            rgb = self.rgb
+            inan = np.where(np.isnan(rgb[:, :, 0]))
+            hsv = mcl.rgb_to_hsv(rgb)
             hsv[:, :, 0][inan] = np.nan
             hsv[:, :, 1][inan] = np.nan
             hsv[:, :, 2][inan] = np.nan
         elif method=='local':
-            f = lambda x: self.rgb2hsv(r=x[0], g=x[1], b=x[2])
-            hsv = np.apply_along_axis(func1d=f, axis=2, arr=self.rgb)
+            return(hsv_bands(self.red, self.green, self.blue, channels='hsv', nthreads=nthreads))
         else:
             raise NotImplementedError('In RGB : hsv method {:s} not implemented'.format(method))
         
@@ -1072,13 +3429,36 @@ class RGB(object):
         # And
         return(hue, saturation, value)
 
+    def hue(self, nthreads=1):
+        '''
+        Return the hue band, computed from the bands without the rgb cube, see
+        `hsv_bands`.
+        '''
+        return(hsv_bands(self.red, self.green, self.blue, channels='h', nthreads=nthreads)[0])
+
+    def saturation(self, nthreads=1):
+        '''
+        Return the saturation band, computed from the bands without the rgb
+        cube, see `hsv_bands`.
+        '''
+        return(hsv_bands(self.red, self.green, self.blue, channels='s', nthreads=nthreads)[0])
+
+    def value(self, nthreads=1):
+        '''
+        Return the value band, computed from the bands without the rgb cube,
+        see `hsv_bands`.
+        '''
+        return(hsv_bands(self.red, self.green, self.blue, channels='v', nthreads=nthreads)[0])
+
     def to_value(self):
         '''
         Return the value part of the hue-saturation-value composition. Value is 
-        simply the maximum of the red-green-blue component.
+        simply the maximum of the red-green-blue component, ignoring np.nan.
         '''
+        data = np.fmax(self.red._values(), self.green._values())
+        np.fmax(data, self.blue._values(), out=data)
         value = Band(
-            data=np.nanmax(self.rgb, axis=2),
+            data=data,
             geotransform=self.geotransform,
             projection=self.projection
         )
@@ -1104,7 +3484,7 @@ class RGB(object):
             plt.savefig(saveto)
             plt.close()
 
-    def to_geotiff(self, fname, dtype=gdal.GDT_Float32, epsg='auto'):
+    def to_geotiff(self, fname, dtype=gdal.GDT_Float32, epsg='auto', cog=False, overviews=None, nodata='auto', **kwargs):
         '''
         Save band data to geotiff to location passed by `to` with datatype
         defined by `dtype`
@@ -1117,20 +3497,220 @@ class RGB(object):
             epsg: epsg code
                 epsg code to reproject the data. `auto` saves the data to
                 original projection. Default `auto` (only option)
+            cog: boolean
+                save as Cloud Optimized GeoTiff with internal overviews
+            overviews: list of int
+                overview levels added to a regular GeoTiff, e.g. [2, 4, 8]
+            nodata: float like, None or 'auto'
+                no data value replacing nan, see `geotiff_nodata`
+            kwargs:
+                creation options, see `geotiff_options`
 
         '''
         fname = Path(fname).as_posix()
-        row, col, nband = self.rgb.shape
         
         if epsg=='auto':
-            driver = gdal.GetDriverByName('GTiff')
-            gtiff = driver.Create(fname, row, col, nband, dtype)
-            gtiff.GetRasterBand(1).WriteArray(self.rgb[:, :, 0])
-            gtiff.GetRasterBand(2).WriteArray(self.rgb[:, :, 1])
-            gtiff.GetRasterBand(3).WriteArray(self.rgb[:, :, 2])
-            gtiff.SetGeoTransform(self.geotransform)
-            gtiff.SetProjection(self.projection)
-            gtiff.FlushCache()
-            gtiff = None
+            write_geotiff(
+                fname=fname,
+                arrays=[self.red._values(), self.green._values(), self.blue._values()],
+                geotransform=self.geotransform,
+                projection=self.projection,
+                dtype=dtype,
+                nodata=nodata,
+                cog=cog,
+                overviews=overviews,
+                **kwargs
+            )
         else:
             raise NotImplementedError
+
+class BlockWriter(object):
+    def __init__(self, fname, like, dtype=gdal.GDT_Float32, cog=False, nodata='auto', **kwargs):
+        '''
+        Write a GeoTiff file block by block, so that the full data never needs
+        to be in memory.
+
+        argument:
+            fname: string
+                The filename to be saved
+            like: Band
+                Band providing the shape, geotransform and projection
+            dtype: gdal data type
+                Gdal datatype to be used for saving, default `gdal.GDT_Float32`
+            cog: boolean
+                convert to Cloud Optimized GeoTiff with internal overviews
+                when closed, the blocks are written to a temporary file
+            nodata: float like, None or 'auto'
+                no data value replacing nan, see `geotiff_nodata`. Default
+                `auto` sets `gdal_nodata` at the first block with nan.
+            kwargs:
+                creation options, see `geotiff_options`
+        '''
+        self.fname = Path(fname).as_posix()
+        self.dtype = dtype
+        self.cog = cog
+        self.options = kwargs
+        row, col = like.shape
+
+        driver = gdal.GetDriverByName('GTiff')
+        if self.cog:
+            self.tmpname = self.fname + '.tmp.tif'
+            self.gtiff = driver.Create(
+                self.tmpname, col, row, 1, dtype,
+                options=geotiff_options(dtype=dtype, compress=None)
+            )
+        else:
+            self.gtiff = driver.Create(
+                self.fname, col, row, 1, dtype,
+                options=geotiff_options(dtype=dtype, **kwargs)
+            )
+        self.gtiff.SetGeoTransform(like.geotransform)
+        self.gtiff.SetProjection(like.projection)
+        self.band = self.gtiff.GetRasterBand(1)
+        self.nbits = None if cog else kwargs.get('nbits')
+        self.nodata = nodata
+        if not isinstance(nodata, str) and nodata is not None:
+            self.band.SetNoDataValue(geotiff_nodata([], dtype, nodata=nodata, nbits=self.nbits))
+
+    def write(self, window, data, outer=None):
+        '''
+        Write the data of a block to the file.
+
+        argument:
+            window: Window
+                Non-overlapping window of the block in the file
+            data: Band or array like
+                Block data
+            outer: Window
+                Window covered by data, if it includes overlap. Default None
+                uses data.attrs['window'] for a Band, otherwise window.
+        '''
+        if isinstance(data, Band):
+            if outer is None:
+                outer = data.attrs.get('window', window)
+            data = data.data
+
+        if outer is None:
+            outer = window
+
+        row = window.row - outer.row
+        col = window.col - outer.col
+        data = data[row:row+window.nrows, col:col+window.ncols]
+        if isinstance(self.nodata, str):
+            # no data value set with the first block having nan
+            nodata = geotiff_nodata([data], self.dtype, nodata=self.nodata, nbits=self.nbits)
+            if nodata is not None:
+                self.nodata = nodata
+                self.band.SetNoDataValue(nodata)
+        else:
+            nodata = self.nodata
+        self.band.WriteArray(to_gdal_array(data, nodata), window.col, window.row)
+
+    def close(self):
+        '''
+        Flush and close the file
+        '''
+        if self.gtiff is not None:
+            self.gtiff.FlushCache()
+            if self.cog:
+                gdal.Translate(
+                    self.fname,
+                    self.gtiff,
+                    format='COG',
+                    creationOptions=geotiff_options(dtype=self.dtype, cog=True, **self.options) + ['OVERVIEWS=AUTO']
+                )
+            self.band = None
+            self.gtiff = None
+            if self.cog:
+                gdal.Unlink(self.tmpname)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+def map_blocks(func, bands, fname=None, size=None, overlap=0, dtype=gdal.GDT_Float32, **kwargs):
+    '''
+    Apply func block by block on the bands and collect the output in a GeoTiff
+    file, or in memory if fname is None.
+
+    The blocks of the bands are passed in the same order as bands to func,
+    which must return a Band or an array of the same shape as the blocks. Only
+    per-pixel operations, or operations with a neighbourhood not larger than
+    overlap, give the same result as on the full band.
+
+    argument:
+        func: callable
+            function applied on the blocks, i.e., func(*blocks)
+        bands: Band or list of Band
+            Bands of same shape, in memory or file backed
+        fname: string
+            The filename to be saved. Default None returns the result in memory
+        size: int or tuple
+            Block size, default None uses the blocksize of the first band
+        overlap: int
+            number of pixels added around each block
+        dtype: gdal data type
+            Gdal datatype to be used for saving, default `gdal.GDT_Float32`
+        kwargs:
+            passed to BlockWriter, e.g., cog, nodata and creation options
+
+    returns:
+        Band, file backed if fname is given, otherwise in memory with the dtype
+        of the func results (the working dtype for boolean results)
+    '''
+    if isinstance(bands, Band):
+        bands = [bands]
+
+    try:
+        assert np.all([isinstance(band, Band) for band in bands])
+        assert np.all([band.shape == bands[0].shape for band in bands])
+    except:
+        raise AssertionError('In map_blocks: bands must be Band of same size')
+
+    if size is None:
+        size = bands[0].blocksize
+
+    like = bands[0]
+    if fname is None:
+        # allocated with the dtype of the first result
+        out = None
+    else:
+        writer = BlockWriter(fname=fname, like=like, dtype=dtype, **kwargs)
+
+    iterators = [band.iter_blocks(size=size, overlap=overlap) for band in bands]
+    try:
+        for blocks in zip(*iterators):
+            window = blocks[0][0]
+            outer = blocks[0][1].attrs['window']
+            result = func(*[block for _, block in blocks])
+            if isinstance(result, Band):
+                result = result.data
+
+            if fname is None:
+                if out is None:
+                    result = np.asarray(result)
+                    out = np.empty(shape=like.shape, dtype=result.dtype if np.issubdtype(result.dtype, np.number) else _dtype)
+                row = window.row - outer.row
+                col = window.col - outer.col
+                out[window.row:window.row+window.nrows, window.col:window.col+window.ncols] = \
+                    result[row:row+window.nrows, col:col+window.ncols]
+            else:
+                writer.write(window, result, outer=outer)
+    finally:
+        if fname is not None:
+            writer.close()
+
+    if fname is None:
+        return(
+            Band(
+                data=out,
+                geotransform=like.geotransform,
+                projection=like.projection
+            )
+        )
+    else:
+        band = Band()
+        band.read(fname=Path(fname).as_posix(), band=1, lazy=True, mask_nodata=True)
+        return(band)
@@ -10,26 +10,38 @@ TODO:
 Author: khan
 Email: jamal.khan@legos.obs-mip.fr
 '''
-import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window as RasterioWindow
 from datetime import datetime
 from glob import glob
 import os
 from pathlib import Path
 import pandas as pd
 import re
-from .core import Band
+from .core import Band, Window, read_dtype, block_geotransform, scaled_geotransform
+from .cache import BandCache, source_stat
+from .pool import dataset_pool
+from .catalogue import Catalogue
 import numpy as np
 import json
+import hashlib
 from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
+from pyproj import CRS, Transformer
+from osgeo import gdal
 
 class Sentinel2(object):
     def __init__(self, loc, datefmt='%Y%m%d-%H%M%S-%f'):
         '''
-        File information holder for unpacked Sentinel-2 images.
+        File information holder for unpacked or zipped Sentinel-2 images.
+
+        The bands of a zip file are read in place with /vsizip/ paths, without
+        extracting it, see configure_vsi_cache.
 
         arguments:
             loc: string
-                Location of the unpacked tile of a single Sentinel-2 image
+                Location of the unpacked tile of a single Sentinel-2 image, or
+                of its zip file
             datefmt: string
                 Format string to extract the datetime
 
@@ -38,21 +50,15 @@ class Sentinel2(object):
         '''
         self.loc = loc
         self.file_prefix = os.path.basename(self.loc)
+        if self.file_prefix.lower().endswith('.zip'):
+            self.file_prefix = self.file_prefix[:-4]
         _metadata = self.file_prefix.split('_')
         self.files = dict()
 
-        for floc in glob(os.path.join(self.loc, '*.*')):
-            fname = os.path.basename(floc)
-            fname = fname.split(sep=self.file_prefix)[-1][1:].split('.')[0]
-            self.files[fname] = floc
-
-        for subdir in glob(os.path.join(self.loc, '*/')):
-            subdir_name = os.path.basename(subdir[:-1]) # Avoiding trailing sep
-            self.files[subdir_name] = dict()
-            for floc in glob(os.path.join(subdir, '*.*')):
-                fname = os.path.basename(floc)
-                fname = fname.split(sep=self.file_prefix)[-1][1:].split('.')[0]
-                self.files[subdir_name][fname] = floc
+        if os.path.isfile(self.loc):
+            self._list_zip()
+        else:
+            self._list_dir()
 
         self.info = dict(
             dir = self.loc,
@@ -65,6 +71,36 @@ class Sentinel2(object):
             version = _metadata[5]
         )
 
+    def _file_key(self, floc):
+        fname = os.path.basename(floc)
+        return(fname.split(sep=self.file_prefix)[-1][1:].split('.')[0])
+
+    def _list_dir(self):
+        for floc in glob(os.path.join(self.loc, '*.*')):
+            self.files[self._file_key(floc)] = floc
+
+        for subdir in glob(os.path.join(self.loc, '*/')):
+            subdir_name = os.path.basename(subdir[:-1]) # Avoiding trailing sep
+            self.files[subdir_name] = dict()
+            for floc in glob(os.path.join(subdir, '*.*')):
+                self.files[subdir_name][self._file_key(floc)] = floc
+
+    def _list_zip(self):
+        # same layout as the extracted directory, the members are under the prefix directory
+        zip_path = Path(self.loc).absolute().as_posix()
+        with ZipFile(self.loc) as zfile:
+            members = [member for member in zfile.namelist() if not member.endswith('/')]
+
+        for member in members:
+            parts = member.split('/')
+            if parts[0] == self.file_prefix:
+                parts = parts[1:]
+            floc = f'/vsizip/{zip_path}/{member}'
+            if len(parts) == 1:
+                self.files[self._file_key(floc)] = floc
+            elif len(parts) == 2:
+                self.files.setdefault(parts[0], dict())[self._file_key(floc)] = floc
+
     def watermask(self, loc, id=['zone'], fmt='tif'):
         '''
         Return the location of the water mask based on the id and format fmt. 
@@ -98,6 +134,27 @@ class Sentinel2(object):
         return(''.join('{:<15s} : {:s}\n'.format(i, self.info[i].__repr__()) for i in self.info))
 
 
+def configure_vsi_cache(size=256, pool=None):
+    """Configure GDAL to cache the reads in the zip files (/vsizip/)
+
+    The options are set for the GDAL of osgeo, used by pyintdem.core.Band, and for the datasets opened by
+    rasterio from the pool. They must be set before the files are opened.
+
+    Args:
+        size (int, optional): Size of the VSI cache per file in MB. Defaults to 256.
+        pool (DatasetPool, optional): Pool of the rasterio datasets. Defaults to None, the shared pool.
+    """
+    options = {
+        'VSI_CACHE': 'TRUE',
+        'VSI_CACHE_SIZE': str(int(size*2**20))
+    }
+    for key, value in options.items():
+        gdal.SetConfigOption(key, value)
+
+    if pool is None:
+        pool = dataset_pool
+    pool.options.update(options)
+
 def format_band_name(band_name):
     band_number = re.findall('\d+', band_name)
 
@@ -192,16 +249,20 @@ def map_theia_bands(fpath):
 
     return ds
 
-def map_copernicus_bands(fpath):
+def map_copernicus_bands(fpath, pool=None):
+    if pool is None:
+        pool = dataset_pool
+
     ds = {}
-    with rasterio.open(fpath) as f:
-        for subds in f.subdatasets:
-            with rasterio.open(subds) as f:
-                band_files = list(filter(lambda x: x.split('.')[-1] == 'jp2', f.files))
-                band_names = list(map(lambda x: x.split('_')[-2], band_files))
+    with pool.open(fpath) as f:
+        subdatasets = f.subdatasets
+    for subds in subdatasets:
+        with pool.open(subds) as f:
+            band_files = list(filter(lambda x: x.split('.')[-1] == 'jp2', f.files))
+        band_names = list(map(lambda x: x.split('_')[-2], band_files))
 
-                for band_name, band_file in zip(band_names, band_files):
-                    ds[format_band_name(band_name)] = band_file
+        for band_name, band_file in zip(band_names, band_files):
+            ds[format_band_name(band_name)] = band_file
 
     return ds
 
@@ -219,8 +280,132 @@ def preprocess_copernicus(band):
     band = band/10000
     return band
 
+def preprocess_key(preprocessor):
+    """Identifier of a preprocessor in the band cache keys
+
+    Functions with the same name (e.g., lambdas) are told apart by a hash of their code,
+    constants and defaults.
+
+    Args:
+        preprocessor (callable): Band preprocessor
+
+    Returns:
+        str: The identifier, or None if the preprocessor can not be identified between sessions,
+            e.g., a closure, a nested function or a callable object
+    """
+    code = getattr(preprocessor, '__code__', None)
+    if code is None or preprocessor.__closure__:
+        return None
+    if any(hasattr(const, 'co_code') for const in code.co_consts):
+        return None
+
+    digest = hashlib.sha1(code.co_code)
+    digest.update(repr((code.co_consts, code.co_names, preprocessor.__defaults__, preprocessor.__kwdefaults__)).encode())
+    return '{:s}.{:s}:{:s}'.format(preprocessor.__module__, preprocessor.__qualname__, digest.hexdigest())
+
+class AOI(object):
+    def __init__(self, aoi, snap=60, densify=21):
+        """Area of interest in WGS84, applied as a window when reading the bands
+
+        The area is transformed once per CRS of the bands and the bounds are cached. The window is snapped outward to
+        a grid of `snap` meters from the raster origin, so that the 10 m, 20 m and 60 m bands of a tile are read over
+        the same extent.
+
+        Args:
+            aoi (tuple or list): Bounding box (west, south, east, north), or polygon as a list of (lon, lat).
+            snap (float, optional): Grid size in the units of the band CRS to which the window is snapped. Defaults to 60.
+            densify (int, optional): Number of points along each edge of the area used for the transformation. Defaults to 21.
+        """
+        if isinstance(aoi, AOI):
+            aoi = aoi.coords
+        elif hasattr(aoi, 'exterior'):
+            # shapely polygon
+            aoi = list(aoi.exterior.coords)
+
+        if len(aoi) == 4 and np.ndim(aoi) == 1:
+            west, south, east, north = aoi
+            aoi = [(west, south), (east, south), (east, north), (west, north)]
+
+        self.coords = [tuple(point[:2]) for point in aoi]
+        self.snap = snap
+        self.densify = densify
+        self._bounds = {}
+
+    def bounds(self, crs):
+        """Bounds of the area in the given CRS, computed once per CRS
+
+        Args:
+            crs (str): CRS in wkt, e.g., rasterio crs.to_wkt()
+
+        Returns:
+            tuple: (xmin, ymin, xmax, ymax)
+        """
+        if crs not in self._bounds:
+            transformer = Transformer.from_crs(CRS.from_epsg(4326), CRS.from_wkt(crs), always_xy=True)
+
+            # densified edges, a straight edge in WGS84 is curved in the band CRS
+            ring = np.array(self.coords + self.coords[:1], dtype=float)
+            t = np.linspace(0, 1, self.densify)[:-1, None]
+            points = np.concatenate([start + t*(end - start) for start, end in zip(ring[:-1], ring[1:])])
+
+            x, y = transformer.transform(points[:, 0], points[:, 1])
+            self._bounds[crs] = (float(np.min(x)), float(np.min(y)), float(np.max(x)), float(np.max(y)))
+
+        return self._bounds[crs]
+
+    def window(self, geotransform, shape, crs):
+        """Window of a raster covering the area, snapped to the `snap` grid and clipped to the raster
+
+        Args:
+            geotransform (tuple): gdal geotransform of the raster, without rotation
+            shape (tuple): (row, col) shape of the raster
+            crs (str): CRS of the raster in wkt
+
+        Returns:
+            Window: The window to be read
+        """
+        xmin, ymin, xmax, ymax = self.bounds(crs)
+        xsize, ysize = geotransform[1], geotransform[5]
+
+        cols = sorted([(xmin - geotransform[0])/xsize, (xmax - geotransform[0])/xsize])
+        rows = sorted([(ymin - geotransform[3])/ysize, (ymax - geotransform[3])/ysize])
+
+        # snapped outward on the grid, in pixels
+        col_step = max(1, int(round(self.snap/abs(xsize))))
+        row_step = max(1, int(round(self.snap/abs(ysize))))
+        col_start = max(0, int(np.floor(cols[0]/col_step))*col_step)
+        col_end = min(shape[1], int(np.ceil(cols[1]/col_step))*col_step)
+        row_start = max(0, int(np.floor(rows[0]/row_step))*row_step)
+        row_end = min(shape[0], int(np.ceil(rows[1]/row_step))*row_step)
+
+        if col_end <= col_start or row_end <= row_start:
+            raise ValueError('The area of interest is outside the raster')
+
+        return Window(row_start, col_start, row_end - row_start, col_end - col_start)
+
 available_parsers = [parse_theia, parse_copernicus]
 
+# batch versions of the name parsers, applied on the file names without extension in parse_files,
+# they accept the same names as the parsers: the same number of fields and a time valid for the format
+name_formats = {
+    parse_theia: {
+        'filetype': 'theia',
+        'regex': re.compile(
+            r'^(?P<mission>[^_]+)_(?P<time>[^_]+)_(?P<product>[^_]+)_(?P<tile>[^_]+)_[^_]+_(?P<version>[^_]+)$'
+        ),
+        'time_format': '%Y%m%d-%H%M%S-%f',
+        'fpath': lambda fpath: fpath.absolute().as_posix()
+    },
+    parse_copernicus: {
+        'filetype': 'copernicus',
+        'regex': re.compile(
+            r'^(?P<mission>[^_]+)_(?P<product>[^_]+)_(?P<time>[^_]+)_[^_]+_[^_]+_(?P<tile>[^_]+)_(?P<version>[^_]+)$'
+        ),
+        'time_format': '%Y%m%dT%H%M%S',
+        'fpath': lambda fpath: fpath
+    }
+}
+
 data_mappers = {
     'theia':map_theia_bands,
     'copernicus':map_copernicus_bands
@@ -232,13 +417,52 @@ band_preprocessors = {
 }
 
 class DataFile(dict):
-    def __init__(self, mapper=None, **kwargs):
+    def __init__(self, mapper=None, aoi=None, cache=None, pool=None, bands=None, **kwargs):
         super().__init__(self)
         self.update(kwargs)
-        
-        self['bands'] = map_bands(self, mapper=mapper)
 
-    def get_band(self, name, number=1, preprocess=True):
+        # open datasets shared by the reads, see DatasetPool
+        self.pool = dataset_pool if pool is None else pool
+
+        # the bands are mapped on first use of self['bands'], see __missing__, unless a precomputed mapping is given
+        self.mapper = mapper
+        if bands is not None:
+            self['bands'] = bands
+
+        # area of interest, applied as window in get_band
+        self.aoi = aoi if aoi is None or isinstance(aoi, AOI) else AOI(aoi)
+
+        # on-disk cache of the decoded bands used in get_band
+        self.cache = cache if cache is None or isinstance(cache, BandCache) else BandCache(cache)
+
+    def __missing__(self, key):
+        # lazy band mapping, the archive is opened once on first use
+        if key == 'bands':
+            self['bands'] = map_bands(self, mapper=self.mapper)
+            return self['bands']
+        raise KeyError(key)
+
+    def get_band(self, name, number=1, preprocess=True, lazy=False, dtype=None, resolution=None, window=None, resampling='nearest', aoi=None, cache=None):
+        """Read a band of the datafile
+
+        The band can be read on a window and at a given resolution, the data is then delivered by rasterio
+        on the target grid (or from the overviews for a lower resolution), without reading the full tile.
+
+        Args:
+            name (str): Name of the band, e.g., B11
+            number (int, optional): Band number in the file. Defaults to 1.
+            preprocess (bool or callable, optional): Apply the preprocessing of the filetype, or the given callable. Defaults to True.
+            lazy (bool, optional): Return a file backed band to be processed block by block, on the window or area of interest if any. Defaults to False.
+            dtype (dtype or str, optional): dtype of the data, None uses the working dtype, 'raw' keeps the file dtype. Defaults to None.
+            resolution (float, optional): Pixel size of the band in the units of the band CRS, e.g., 10 to read B11 at 10 m. Defaults to None, the native resolution.
+            window (Window, optional): Window to be read, a pyintdem.core.Window or a rasterio Window. Defaults to None, the full tile.
+            resampling (str, optional): Resampling method with resolution, a rasterio Resampling name, e.g., nearest, bilinear, cubic, average. Defaults to 'nearest'.
+            aoi (AOI, tuple or list, optional): Area of interest read instead of the full tile, see AOI. Defaults to None, the area of interest of the datafile if any.
+            cache (BandCache or str, optional): On-disk cache of the decoded and preprocessed bands, keyed by the file and the reading arguments. Not used with lazy, nor with a preprocessor without identifier, see preprocess_key. Defaults to None, the cache of the datafile if any.
+
+        Returns:
+            Band: The band data
+        """
         if callable(preprocess):
             preprocessor = preprocess
         else:
@@ -247,27 +471,115 @@ class DataFile(dict):
             else:
                 preprocessor = preprocess_none
 
+        if aoi is None:
+            aoi = self.aoi
+        elif not isinstance(aoi, AOI):
+            aoi = AOI(aoi)
+
+        if cache is None:
+            cache = self.cache
+        elif not isinstance(cache, BandCache):
+            cache = BandCache(cache)
+
         band_fname = self['bands'][name]
-        ds = rasterio.open(band_fname)
+
+        if window is not None and not isinstance(window, Window):
+            window = Window(window.row_off, window.col_off, window.height, window.width)
+
+        # the bands of an unidentified preprocessor are not cached, see preprocess_key
+        if cache is not None and preprocess_key(preprocessor) is None:
+            cache = None
+
+        if cache is not None and not lazy:
+            key = cache.key(
+                band_fname,
+                number=number,
+                window=None if window is None else (window.row, window.col, window.nrows, window.ncols),
+                resolution=resolution,
+                resampling=resampling,
+                aoi=None if aoi is None else (aoi.coords, aoi.snap),
+                preprocess=preprocess_key(preprocessor),
+                dtype=read_dtype(dtype)
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                data, meta = cached
+                band = Band(data=data, geotransform=tuple(meta['geotransform']), projection=meta['projection'])
+                band.nodata = meta['nodata']
+                return(band)
+
+        if lazy and resolution is not None:
+            raise NotImplementedError('In get_band: resolution is not available with lazy')
+
+        with self.pool.open(band_fname) as ds:
+            if window is None and aoi is not None:
+                window = aoi.window(ds.get_transform(), (ds.height, ds.width), ds.crs.to_wkt())
+            elif window is None:
+                window = Window(0, 0, ds.height, ds.width)
+            geotransform = block_geotransform(ds.get_transform(), window)
+
+            if lazy:
+                # file backed band on the window, preprocessed block by block in Band.iter_blocks
+                band = Band(
+                    geotransform=geotransform,
+                    projection=ds.crs.to_wkt()
+                    )
+                band.source = (band_fname, number, dtype)
+                if window != Window(0, 0, ds.height, ds.width):
+                    band.source_window = window
+                band.preprocess = preprocessor
+                return(band)
+
+            if resolution is None:
+                out_shape = None
+            else:
+                out_shape = (
+                    max(1, int(round(window.nrows*abs(geotransform[5])/resolution))),
+                    max(1, int(round(window.ncols*abs(geotransform[1])/resolution)))
+                )
+                geotransform = scaled_geotransform(geotransform, (window.nrows, window.ncols), out_shape)
+
+            data = ds.read(
+                number,
+                window=RasterioWindow(col_off=window.col, row_off=window.row, width=window.ncols, height=window.nrows),
+                out_shape=out_shape,
+                resampling=Resampling[resampling]
+            )
+            if read_dtype(dtype) is not None:
+                data = data.astype(read_dtype(dtype), copy=False)
+            projection = ds.crs.to_wkt()
+
         band = Band(
-            data=ds.read(number).astype(float),
-            geotransform=ds.get_transform(),
-            projection=ds.crs.to_wkt()
+            data=data,
+            geotransform=geotransform,
+            projection=projection
             )
-        
-        return(preprocessor(band))
+        band = preprocessor(band)
+
+        if cache is not None:
+            meta = {
+                'geotransform': list(band.geotransform),
+                'projection': band.projection,
+                'nodata': None if band.nodata is None else float(band.nodata)
+            }
+            band.data = cache.put(key, band.data, meta)
+
+        return(band)
     
-    def get_mask(self, mask_dir, ext='.tif'):
+    def get_mask(self, mask_dir, ext='.tif', mask_nodata=False):
         mask_dir = Path(mask_dir)
         tile_name = self['tile']
         mask_fname = tile_name + ext
         mask_fpath = mask_dir / mask_fname
-        ds = rasterio.open(mask_fpath)
-        band = Band(
-            data=ds.read(1),
-            geotransform=ds.get_transform(),
-            projection=ds.crs.to_wkt()
-        )
+        with self.pool.open(mask_fpath) as ds:
+            band = Band(
+                data=ds.read(1),
+                geotransform=ds.get_transform(),
+                projection=ds.crs.to_wkt()
+            )
+            # no data of the compact masks saved as integer, see Band.to_geotiff
+            if mask_nodata and not np.issubdtype(band.data.dtype, np.floating):
+                band.nodata = ds.nodata
         return(band)
         
 
@@ -286,35 +598,159 @@ def map_bands(datafile, mapper=None):
     return ds
 
 class Database(dict):
-    def __init__(self, fdir, patterns=['*/*.zip*', '*/*.SAFE'], nameparsers=available_parsers):
-
+    def __init__(self, fdir, patterns=['*/*.zip*', '*/*.SAFE'], nameparsers=available_parsers, aoi=None, cache=None, pool=None, nworkers=1, catalogue=None, lazy=True):
+        """Datafiles of a directory, grouped by tile
+
+        Args:
+            fdir (str): Directory of the archives
+            patterns (list, optional): Glob patterns of the archives in fdir. Defaults to ['*/*.zip*', '*/*.SAFE'].
+            nameparsers (list, optional): Name parsers, see parse_files. Defaults to available_parsers.
+            aoi (AOI, tuple or list, optional): Area of interest of the datafiles, see AOI. Defaults to None.
+            cache (BandCache or str, optional): Band cache of the datafiles, see DataFile.get_band. Defaults to None.
+            pool (DatasetPool, optional): Pool of open datasets. Defaults to None, the shared dataset_pool.
+            nworkers (int, optional): Number of threads mapping the bands of the archives. With lazy, the bands
+                are mapped on first use, one archive at a time, and nworkers is only used by prefetch. Defaults to 1.
+            catalogue (Catalogue or str, optional): Catalogue the database starts from and is saved to, only the
+                new or modified archives are mapped. Defaults to None.
+            lazy (bool, optional): Map the bands of a datafile on first use instead of opening all the archives
+                in the constructor. Defaults to True.
+        """
         super().__init__(self)
 
         self.fdir = fdir
         self.patterns = patterns
         self.nameparsers = nameparsers
 
+        # area of interest shared by the datafiles, transformed once per CRS
+        self.aoi = aoi if aoi is None or isinstance(aoi, AOI) else AOI(aoi)
+
+        # band cache shared by the datafiles
+        self.cache = cache if cache is None or isinstance(cache, BandCache) else BandCache(cache)
+
+        # open datasets shared by the datafiles
+        self.pool = dataset_pool if pool is None else pool
+
+        # number of threads mapping the bands of the archives, and mapping on first use, see prefetch
+        self.nworkers = nworkers
+        self.lazy = lazy
+
+        if catalogue is not None:
+            # start from the catalogue, only the changed archives are mapped, and save it back
+            self.from_catalogue(catalogue)
+            self.refresh()
+            self.to_catalogue(catalogue)
+            return
+
         self.files = listfiles(self.fdir, patterns=self.patterns)
         self.datafiles = list_datafiles(fnames=self.files, parsers=self.nameparsers)
 
         # convert to DataFile from dictionary
-        self.datafiles = [DataFile(**datafile) for datafile in self.datafiles]
+        self.datafiles = self.map_datafiles(self.datafiles)
         
         self.update(sort_datafiles_by_tiles(self.datafiles))
 
+    def _datafile(self, datafile):
+        # the size and modification time of the archive are kept to detect the changes in refresh
+        _, size, mtime = source_stat(datafile['fpath'])
+        datafile = DataFile(aoi=self.aoi, cache=self.cache, pool=self.pool, stat=[size, mtime], **datafile)
+        if not self.lazy:
+            datafile['bands']
+        return datafile
+
+    def map_datafiles(self, datafiles):
+        """Convert the parsed datafiles to DataFile
+
+        The bands are mapped on first use if lazy (see prefetch), otherwise the archives are opened
+        (zip directory or SAFE metadata) by nworkers threads.
+
+        Args:
+            datafiles (list): Parsed datafiles, see list_datafiles
+
+        Returns:
+            list: List of DataFile, in the same order
+        """
+        if not self.lazy and self.nworkers > 1 and len(datafiles) > 1:
+            with ThreadPoolExecutor(max_workers=self.nworkers) as executor:
+                return list(executor.map(self._datafile, datafiles))
+        else:
+            return [self._datafile(datafile) for datafile in datafiles]
+
+    def prefetch(self, datafiles=None):
+        """Map the bands of the datafiles which are not mapped yet, by nworkers threads
+
+        With lazy, the archives are otherwise opened on first use, one at a time, e.g., in a loop over the
+        datafiles.
+
+        Args:
+            datafiles (list, optional): DataFile to be mapped. Defaults to None, all the datafiles of the database.
+
+        Returns:
+            int: Number of mapped datafiles
+        """
+        if datafiles is None:
+            datafiles = [datafile for tile in self for datafile in self[tile]]
+        datafiles = [datafile for datafile in datafiles if 'bands' not in datafile]
+
+        if self.nworkers > 1 and len(datafiles) > 1:
+            with ThreadPoolExecutor(max_workers=self.nworkers) as executor:
+                list(executor.map(lambda datafile: datafile['bands'], datafiles))
+        else:
+            for datafile in datafiles:
+                datafile['bands']
+        return(len(datafiles))
+
+    def refresh(self):
+        """Rescan the directory and only map the new or modified archives
+
+        An archive is mapped again if its path, size or modification time changed since it was mapped
+        (or saved with to_file and loaded with from_file). The removed archives are dropped.
+
+        Returns:
+            int: Number of mapped archives
+        """
+        known = {}
+        for tile in self:
+            for datafile in self[tile]:
+                known[Path(datafile['fpath']).as_posix()] = datafile
+
+        self.files = listfiles(self.fdir, patterns=self.patterns)
+        parsed = list_datafiles(fnames=self.files, parsers=self.nameparsers)
+
+        datafiles = []
+        changed = []
+        for datafile in parsed:
+            previous = known.get(Path(datafile['fpath']).as_posix())
+            _, size, mtime = source_stat(datafile['fpath'])
+            if isinstance(previous, DataFile) and list(previous.get('stat', [])) == [size, mtime]:
+                datafiles.append(previous)
+            else:
+                datafiles.append(None)
+                changed.append(datafile)
+
+        # map the changed archives and put them back in the listing order
+        mapped = iter(self.map_datafiles(changed))
+        self.datafiles = [next(mapped) if datafile is None else datafile for datafile in datafiles]
+
+        self.clear()
+        self.update(sort_datafiles_by_tiles(self.datafiles))
+        return(len(changed))
+
     @property
     def tiles(self):
         return list(self.keys())
     
     def to_file(self, fname):
-        # serialize the time
-        database = self.copy()
-        for tile in database:
-            for datafile in database[tile]:
+        # serialize the time, on copies of the datafiles
+        database = {}
+        for tile in self:
+            database[tile] = []
+            for datafile in self[tile]:
+                datafile = dict(datafile)
                 datafile['time'] = datafile['time'].strftime('%Y-%m-%d %H:%M:%S.%f')
+                database[tile].append(datafile)
 
         with open(fname, 'w') as fp:
-            json.dump(database, fp=fp, indent=2)
+            json.dump(database, fp=fp, indent=2, default=str)
 
     def from_file(self, fname):
         with open(fname, 'r') as fp:
@@ -322,11 +758,56 @@ class Database(dict):
             for tile in database:
                 for datafile in database[tile]:
                     datafile['time'] = pd.to_datetime(datafile['time'], format='%Y-%m-%d %H:%M:%S.%f')
+                    datafile['fpath'] = Path(datafile['fpath'])
+
+        # convert to DataFile, keeping the saved band mapping
+        for tile in database:
+            database[tile] = [self._restore(datafile) for datafile in database[tile]]
+        self.datafiles = [datafile for tile in database for datafile in database[tile]]
 
         self.update(database)
 
+    def _restore(self, datafile):
+        # DataFile from a saved record, with its band mapping
+        return DataFile(aoi=self.aoi, cache=self.cache, pool=self.pool, **datafile)
+
+    def to_catalogue(self, catalogue):
+        """Save the datafiles in a catalogue
+
+        The datafiles which are not in the database anymore are removed from the catalogue.
+
+        Args:
+            catalogue (Catalogue or str): Catalogue or path of the SQLite file
+        """
+        if not isinstance(catalogue, Catalogue):
+            with Catalogue(catalogue) as catalogue:
+                return self.to_catalogue(catalogue)
+
+        datafiles = [datafile for tile in self for datafile in self[tile]]
+        fpaths = set(Path(datafile['fpath']).as_posix() for datafile in datafiles)
+        catalogue.remove([fpath for fpath in catalogue.query()['fpath'] if fpath not in fpaths])
+        catalogue.add(datafiles)
+
+    def from_catalogue(self, catalogue, **query):
+        """Load the datafiles from a catalogue
+
+        Args:
+            catalogue (Catalogue or str): Catalogue or path of the SQLite file
+            **query: Selection of the datafiles, see Catalogue.query, e.g., tile='T30TXR', start='2021-01-01'
+
+        Returns:
+            Database: The database, updated with the selected datafiles
+        """
+        if not isinstance(catalogue, Catalogue):
+            with Catalogue(catalogue) as catalogue:
+                return self.from_catalogue(catalogue, **query)
+
+        self.datafiles = [self._restore(datafile) for datafile in catalogue.datafiles(**query)]
+        self.update(sort_datafiles_by_tiles(self.datafiles))
+        return(self)
+
     def clear(self):
-        for key in self:
+        for key in list(self):
             self.pop(key)
 
 
@@ -376,16 +857,73 @@ def parse_file(fname, parsers=[parse_theia, parse_copernicus]):
 
     return(is_parseable, info)
 
+def parse_files(fnames, parsers=[parse_theia, parse_copernicus]):
+    """Parse a list of file names at once
+
+    The parsers are tried in order, as in parse_file. The parsers with a batch version in name_formats
+    are matched with compiled regular expressions and their times converted in one call, the other
+    parsers (e.g., custom ones) are applied file by file on the remaining names.
+
+    Args:
+        fnames (list): Paths of the files
+        parsers (list or callable, optional): Name parsers. Defaults to [parse_theia, parse_copernicus].
+
+    Returns:
+        pandas.DataFrame: One row per parsed file, in the order of fnames, with filetype, fpath, mission, product, version, time, tile
+    """
+    if callable(parsers):
+        parsers = [parsers]
+
+    fpaths = [Path(fname) for fname in fnames]
+    names = pd.Series([fpath.name.split('.')[0] for fpath in fpaths], dtype=object)
+    remaining = pd.Series(True, index=names.index)
+
+    parsed = []
+    for parser in parsers:
+        if not remaining.any():
+            break
+
+        if parser in name_formats:
+            name_format = name_formats[parser]
+            fields = names[remaining].str.extract(name_format['regex'])
+            fields['time'] = pd.to_datetime(fields['time'], format=name_format['time_format'], errors='coerce')
+            fields = fields[fields['time'].notna()]
+            fields['filetype'] = name_format['filetype']
+            fields['fpath'] = [name_format['fpath'](fpaths[index]) for index in fields.index]
+            parsed.append(fields)
+            remaining[fields.index] = False
+        else:
+            infos = {}
+            for index in remaining.index[remaining]:
+                try:
+                    infos[index] = parser(fpaths[index])
+                except Exception:
+                    pass
+            if infos:
+                parsed.append(pd.DataFrame.from_dict(infos, orient='index'))
+                remaining[list(infos)] = False
+
+    columns = ['filetype', 'fpath', 'mission', 'product', 'version', 'time', 'tile']
+    if len(parsed) == 0:
+        return pd.DataFrame(columns=columns)
+
+    datafiles = pd.concat(parsed).sort_index()
+    columns = columns + [column for column in datafiles.columns if column not in columns]
+    return datafiles.reindex(columns=columns).reset_index(drop=True)
+
 def list_datafiles(fnames, parsers=[parse_theia, parse_copernicus]):
-    parsed_files = []
-    for fname in fnames:
-        is_parseable, info = parse_file(fname, parsers=parsers)
-        if is_parseable:
-            parsed_files.append(info)
+    datafiles = parse_files(fnames, parsers=parsers)
 
-    return(parsed_files)
+    # dictionaries without the missing values of the columns of the other parsers
+    return([
+        {key: value for key, value in datafile.items() if not (np.isscalar(value) and pd.isna(value))}
+        for datafile in datafiles.to_dict('records')
+    ])
 
 def sort_datafiles_by_tiles(datafiles):
+    if isinstance(datafiles, pd.DataFrame):
+        datafiles = datafiles.to_dict('records')
+
     database = {}
     for datafile in datafiles:
         tile = datafile['tile']
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Pool of open rasterio datasets
+
+Opening a band re-parses the archive directory (/vsizip/) or the SAFE
+metadata and the file header. The pool keeps a bounded number of datasets
+open, closes the least recently used ones, and runs the reads in a GDAL
+environment with the block cache size and the decoding threads configured.
+'''
+import threading
+import atexit
+import rasterio
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class _Handle(object):
+    __slots__ = ('dataset', 'lock', 'users')
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.lock = threading.Lock()
+        self.users = 0
+
+class DatasetPool(object):
+    def __init__(self, max_open=64, cachemax=512, num_threads='ALL_CPUS', **options):
+        """Bounded and thread-safe pool of open rasterio datasets
+
+        A dataset is used by one thread at a time; different files are read concurrently.
+
+        Args:
+            max_open (int, optional): Maximum number of datasets kept open. Defaults to 64.
+            cachemax (int, optional): GDAL block cache size (GDAL_CACHEMAX) in MB. Defaults to 512.
+            num_threads (int or str, optional): Number of decoding threads (GDAL_NUM_THREADS), e.g., for JPEG2000. Defaults to 'ALL_CPUS'.
+            **options: Other GDAL configuration options, e.g., VSI_CACHE=True.
+        """
+        self.max_open = max_open
+        self.options = dict(GDAL_CACHEMAX=cachemax, GDAL_NUM_THREADS=num_threads, **options)
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def env(self):
+        """GDAL environment of the pool
+
+        Returns:
+            rasterio.Env: The environment with the configuration options
+        """
+        return rasterio.Env(**self.options)
+
+    def _acquire(self, fname):
+        with self._lock:
+            handle = self._handles.get(fname)
+            if handle is not None and not handle.dataset.closed:
+                self._handles.move_to_end(fname)
+                handle.users += 1
+                return handle
+
+        # opened outside of the pool lock, the other files are opened concurrently
+        dataset = rasterio.open(fname)
+
+        with self._lock:
+            handle = self._handles.get(fname)
+            if handle is not None and not handle.dataset.closed:
+                # opened by another thread in the meantime
+                dataset.close()
+            else:
+                handle = _Handle(dataset)
+                self._handles[fname] = handle
+            self._handles.move_to_end(fname)
+            handle.users += 1
+            self._evict()
+        return handle
+
+    def _release(self, handle):
+        with self._lock:
+            handle.users -= 1
+            self._evict()
+
+    def _evict(self):
+        # close the least recently used datasets which are not in use
+        for fname in list(self._handles):
+            if len(self._handles) <= self.max_open:
+                break
+            handle = self._handles[fname]
+            if handle.users == 0:
+                handle.dataset.close()
+                del self._handles[fname]
+
+    @contextmanager
+    def open(self, fname):
+        """Open dataset from the pool
+
+        The dataset must not be closed nor used outside of the context.
+
+        Args:
+            fname (str): Path of the dataset, e.g., a /vsizip/ path or a subdataset
+
+        Yields:
+            rasterio.DatasetReader: The open dataset
+        """
+        fname = str(fname)
+        with self.env():
+            handle = self._acquire(fname)
+            try:
+                with handle.lock:
+                    yield handle.dataset
+            finally:
+                self._release(handle)
+
+    def close(self):
+        """Close all the datasets which are not in use"""
+        with self._lock:
+            for fname in list(self._handles):
+                handle = self._handles[fname]
+                if handle.users == 0:
+                    handle.dataset.close()
+                    del self._handles[fname]
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# pool shared by the datafiles by default
+dataset_pool = DatasetPool()
+atexit.register(dataset_pool.close)
@@ -8,12 +8,57 @@ import os
 import numpy as np
 import tqdm
 import logging
+from fnmatch import fnmatch
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from .core import Band
+from .data import Sentinel2, configure_vsi_cache
 
 logger = logging.getLogger(__name__)
 
 
+def extract_members(fname, output_dir, patterns=None, overwrite=False):
+    '''
+    Extract the members of a zip file matching the patterns.
+
+    arguments:
+        fname: string
+            Path of the zip file
+        output_dir: string
+            Directory to extract to
+        patterns: list of string, optional
+            Unix shell style patterns matched on the member file names, e.g.,
+            ['*FRE_B4.tif', '*.jpg']. None extracts all the members.
+        overwrite: boolean
+            Extract the members again even if they exist with the same size
+
+    returns:
+        nfiles, nbytes, seconds: number of extracted files and bytes, and time spent
+    '''
+    start_time = time.time()
+    nfiles = 0
+    nbytes = 0
+
+    with zipfile.ZipFile(file=fname) as zfile:
+        for member in zfile.infolist():
+            if member.is_dir():
+                continue
+
+            if patterns is not None and not any(fnmatch(os.path.basename(member.filename), pattern) for pattern in patterns):
+                continue
+
+            # a partially extracted file has a different size and is extracted again
+            target = os.path.join(output_dir, member.filename)
+            if not overwrite and os.path.exists(target) and os.path.getsize(target) == member.file_size:
+                continue
+
+            zfile.extract(member, output_dir)
+            nfiles += 1
+            nbytes += member.file_size
+
+    return(nfiles, nbytes, time.time() - start_time)
+
+
 class Extractor(object):
     def __init__(self, input_dir, output_dir):
         '''
@@ -64,13 +109,21 @@ class Extractor(object):
         for zone in self.zones:
             logger.debug('- {:s} : {:d} tiles'.format(zone, len(self.zones[zone])))
 
-    def extract(self, zone):
+    def extract(self, zone, patterns=None, nworkers=1, overwrite=False):
         '''
         Extract the zip files for a particular zone listed using list_zones()
 
         arguments:
             zone: string
                 zone id to be extracted
+            patterns: list of string, optional
+                Members to be extracted, matched on the file names, e.g.,
+                ['*FRE_B2.tif', '*FRE_B4.tif', '*FRE_B8.tif', '*FRE_B11.tif'].
+                None extracts all the members.
+            nworkers: int
+                Number of processes extracting the zip files in parallel
+            overwrite: boolean
+                Extract the members again even if they are already extracted
         '''
 
         try:
@@ -84,24 +137,62 @@ class Extractor(object):
             if not os.path.exists(zone_dir):
                 os.mkdir(zone_dir)
 
-            for fname in tqdm.tqdm(self.zones[zone], desc=zone):
-                start_time = time.time()
-                zfile = zipfile.ZipFile(file=fname)
-                zfile.extractall(zone_dir)
-                zfile.close()
-                logger.info('\t|- Extracted : {zone_name:s} - {file_name:s} in {te:s}'.format(
-                    zone_name=zone,
-                    file_name=os.path.basename(fname),
-                    te=str(time.time() - start_time)
-                ))
+            start_time = time.time()
+            total_bytes = 0
+            with ProcessPoolExecutor(max_workers=nworkers) as executor:
+                futures = {
+                    executor.submit(extract_members, fname, zone_dir, patterns, overwrite): fname
+                    for fname in self.zones[zone]
+                }
+                for future in tqdm.tqdm(as_completed(futures), total=len(futures), desc=zone):
+                    fname = futures[future]
+                    nfiles, nbytes, te = future.result()
+                    total_bytes += nbytes
+                    logger.info('\t|- Extracted : {zone_name:s} - {file_name:s} - {nfiles:d} files in {te:.1f} s ({speed:.1f} MB/s)'.format(
+                        zone_name=zone,
+                        file_name=os.path.basename(fname),
+                        nfiles=nfiles,
+                        te=te,
+                        speed=nbytes/2**20/max(te, 1e-6)
+                    ))
+
+            te = time.time() - start_time
+            logger.info('|- Extracted {:.1f} MB of {:s} in {:.1f} s ({:.1f} MB/s with {:d} workers)'.format(
+                total_bytes/2**20, zone, te, total_bytes/2**20/max(te, 1e-6), nworkers
+            ))
+
+    def mount(self, zone, cache_size=256):
+        '''
+        Open the zip files of a zone in place, without extracting them. The
+        bands are read through /vsizip/ paths with the GDAL VSI cache.
+
+        arguments:
+            zone: string
+                zone id to be mounted
+            cache_size: int
+                Size of the VSI cache per file in MB, see configure_vsi_cache.
+                None keeps the current GDAL configuration.
+
+        returns:
+            list of Sentinel2: the images of the zone
+        '''
+        try:
+            assert zone in self.zones
+        except AssertionError:
+            raise AssertionError('{:s} - Not found! Use list_zones method to list all tiles.'.format(zone))
+
+        if cache_size is not None:
+            configure_vsi_cache(size=cache_size)
+
+        return([Sentinel2(loc=fname) for fname in sorted(self.zones[zone])])
 
 
-def create_mask(database, maskdir, nmask=0.5, ext='tif', band='B11', normalize=True):
+def create_mask(database, maskdir, nmask=0.5, ext='tif', band='B11', normalize=True, resolution=None):
     for tile in database:
         fname = maskdir / f'{tile}.{ext}'
         datafiles = database[tile]
         for i, datafile in enumerate(datafiles):
-            img_band = datafile.get_band(band, preprocess=True)
+            img_band = datafile.get_band(band, preprocess=True, resolution=resolution)
 
             if normalize:
                 img_band.normalize(method='std', std_factor=1, std_correction='high')
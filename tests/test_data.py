@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+rasterio = pytest.importorskip('rasterio')
+
+from rasterio.windows import Window as RasterioWindow
+from pyintdem.data import DataFile, preprocess_none
+
+@pytest.fixture
+def band_file(tmp_path):
+    fname = tmp_path / 'B11.tif'
+    data = np.arange(64*48, dtype='uint16').reshape(64, 48)
+    with rasterio.open(
+        fname, 'w', driver='GTiff', height=64, width=48, count=1, dtype='uint16',
+        crs='EPSG:32630', transform=rasterio.Affine(20, 0, 600000, 0, -20, 5000000)
+    ) as ds:
+        ds.write(data, 1)
+    return fname, data
+
+def test_get_band_cache_rasterio_window(band_file, tmp_path):
+    fname, data = band_file
+    datafile = DataFile(mapper=lambda fpath: {'B11': str(fpath)}, filetype='theia', fpath=fname, cache=tmp_path / 'cache')
+    window = RasterioWindow(col_off=8, row_off=4, width=16, height=10)
+
+    band = datafile.get_band('B11', preprocess=preprocess_none, window=window)
+    cached = datafile.get_band('B11', preprocess=preprocess_none, window=window)
+
+    assert len(list(datafile.cache.cache_dir.glob('*.npy'))) == 1
+    np.testing.assert_array_equal(band.data, data[4:14, 8:24])
+    np.testing.assert_array_equal(cached.data, band.data)
+    assert cached.geotransform == band.geotransform
+    assert band.geotransform[0] == 600000 + 8*20
+    assert band.geotransform[3] == 5000000 - 4*20